@@ -0,0 +1,799 @@
+#! /usr/bin/env python
+
+"""Rough benchmarks for cmdline.py.
+
+Each command builds synthetic apps and times some part of cmdline.py
+against them. Times are wall-clock, so run them on a quiet machine and
+compare numbers from the same machine.
+
+Run 'suite' to get every benchmark at once. To compare revisions, save
+the output of 'bench.py --json-output suite' for each and diff them.
+
+json_output -- if True, print results as JSON lines rather than tables.
+
+"""
+
+# Standard library imports.
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+# Local imports.
+import cmdline
+
+app = cmdline.App(usage_msg=__doc__, arg_types={'reps': int, 'num_cmds': int,
+                                                 'num_values': int,
+                                                 'num_lines': int,
+                                                 'budget': float})
+
+# Module variables.
+json_output = False
+
+app.make_global_opts(globals(), arg_types={'json_output': bool})
+
+# Filler for the docstrings of synthetic commands.
+_PARA = '''    This paragraph is only here to make the docstring longer, so it takes
+    as long to parse as the docstring of a real command might.
+
+'''
+
+def _make_func(name, num_opts, num_paras=0):
+    """Return a function called `name` with `num_opts` keyword args.
+
+    Every other keyword arg is a flag, so parsing exercises both flags
+    and valued options. The function's docstring has `num_paras`
+    paragraphs of filler and describes every keyword arg.
+
+    """
+
+    params = []
+    descs = []
+    for i in range(num_opts):
+        default = 'False' if i % 2 == 0 else "'x'"
+        params.append('opt_%d=%s' % (i, default))
+        descs.append('    opt_%d -- option number %d.\n' % (i, i))
+
+    doc = 'Do something or other.\n\n%s%s\n    ' % (_PARA * num_paras,
+                                                    ''.join(descs))
+    src = 'def %s(%s):\n    """%s"""\n    pass\n' % (name, ', '.join(params),
+                                                     doc)
+    namespace = {}
+    exec src in namespace
+
+    return namespace[name]
+
+def _make_app(num_opts, num_cmds=1, num_paras=0):
+    """Return an App with `num_cmds` subcommands of `num_opts` options.
+
+    The first command is called 'cmd', and the rest 'cmd_1', 'cmd_2'
+    and so on. Each has `num_paras` paragraphs of docstring filler.
+    There are far more options than letters, so none get short names.
+
+    """
+
+    short_names = dict(('opt_%d' % i, None) for i in range(num_opts))
+
+    bench_app = cmdline.App()
+    for num in range(num_cmds):
+        name = 'cmd_%d' % num if num else 'cmd'
+        func = _make_func(name, num_opts, num_paras)
+        bench_app.command(short_names=dict(short_names))(func)
+
+    return bench_app
+
+def _opts_argv(num_opts):
+    """Return argv passing the first `num_opts` options to 'cmd'."""
+
+    argv = ['bench', 'cmd']
+    for i in range(num_opts):
+        if i % 2 == 0:
+            argv.append('--opt-%d' % i)
+        else:
+            argv.extend(['--opt-%d' % i, 'value'])
+
+    return argv
+
+# Template for the commands in apps written by _write_app().
+_CMD_TEMPLATE = '''
+@app.command
+def cmd_%(num)d(path, count=1, verbose=False):
+    """Do something or other with `path`.
+
+%(paras)s
+    path -- the path to do something or other with.
+    count -- how many times to do it.
+    verbose -- if True, talk about it.
+
+    """
+
+    pass
+'''
+
+def _write_app(dirname, num_cmds, num_paras=3):
+    """Write a script with `num_cmds` commands to `dirname`.
+
+    Return the script's path. Each command's docstring has `num_paras`
+    paragraphs of filler. If the environment variable BENCH_CACHE is
+    set when the script runs, it is used as the App's cache_path.
+
+    """
+
+    lines = ['import os',
+             'import cmdline',
+             "app = cmdline.App(cache_path=os.environ.get('BENCH_CACHE'))"]
+    for num in range(num_cmds):
+        lines.append(_CMD_TEMPLATE % {'num': num, 'paras': _PARA * num_paras})
+    lines.append("if __name__ == '__main__':")
+    lines.append('    app.run()')
+
+    path = os.path.join(dirname, 'bench_app_%d.py' % num_cmds)
+    with open(path, 'w') as script:
+        script.write('\n'.join(lines))
+
+    return path
+
+def _time_process(argv, reps, env=None, before=None):
+    """Return the average number of seconds it takes to run `argv`.
+
+    env -- optional dict of extra environment variables.
+    before -- optional callable to run (untimed) before each run.
+
+    """
+
+    full_env = dict(os.environ)
+    full_env['PYTHONPATH'] = os.path.dirname(os.path.abspath(cmdline.__file__))
+    full_env.update(env or {})
+
+    total = 0
+    with open(os.devnull, 'w') as devnull:
+        for i in range(reps):
+            if before is not None:
+                before()
+
+            start = time.time()
+            subprocess.check_call(argv, env=full_env, stdout=devnull,
+                                  stderr=devnull)
+            total += time.time() - start
+
+    return total / reps
+
+def _time(func, reps, before=None):
+    """Return the average number of seconds `func()` takes to run.
+
+    before -- optional callable to run (untimed) before each call.
+
+    """
+
+    if before is None:
+        start = time.time()
+        for i in xrange(reps):
+            func()
+
+        return (time.time() - start) / reps
+
+    total = 0
+    for i in xrange(reps):
+        before()
+        start = time.time()
+        func()
+        total += time.time() - start
+
+    return total / reps
+
+def _revision():
+    """Return the git revision cmdline.py is from, or None."""
+
+    dirname = os.path.dirname(os.path.abspath(cmdline.__file__))
+    try:
+        with open(os.devnull, 'w') as devnull:
+            rev = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                          cwd=dirname, stderr=devnull)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return rev.strip()
+
+def _report(name, columns, rows):
+    """Print the results of benchmark `name`.
+
+    columns -- list of column names. Names of timing columns give their
+               unit, as in 'usec/parse'.
+    rows -- list of tuples, one value per column.
+
+    Results are printed as a table, or if json_output is True as a
+    single line of JSON.
+
+    """
+
+    if json_output:
+        print json.dumps({'benchmark': name,
+                          'revision': _revision(),
+                          'python': platform.python_version(),
+                          'platform': platform.platform(),
+                          'results': [dict(zip(columns, row))
+                                      for row in rows]},
+                         sort_keys=True)
+        return
+
+    print name
+    print '  '.join('%12s' % col for col in columns)
+    for row in rows:
+        cells = []
+        for val in row:
+            if isinstance(val, float):
+                cells.append('%12.2f' % val)
+            else:
+                cells.append('%12s' % val)
+        print '  '.join(cells)
+    print
+
+@app.command
+def parse(reps=2000):
+    """Time parsing argv as the number of options grows.
+
+    The short argv passes the same eight options for every app, so parse
+    time per call should stay flat no matter how many options the
+    command has. The long argv passes every option, so time per item
+    should stay flat.
+
+    reps -- number of times to parse the short argv for each app. The
+            long argv is parsed a tenth as often.
+
+    """
+
+    rows = []
+    for num_opts in (10, 100, 1000, 5000):
+        bench_app = _make_app(num_opts)
+
+        short_argv = _opts_argv(8)
+        short_secs = _time(lambda: bench_app._parse_argv(short_argv), reps)
+
+        long_argv = _opts_argv(num_opts)
+        long_secs = _time(lambda: bench_app._parse_argv(long_argv),
+                          max(reps // 10, 1))
+
+        rows.append((num_opts, short_secs * 1000000, len(long_argv),
+                     long_secs * 1000000,
+                     long_secs * 1000000000 / len(long_argv)))
+
+    _report('parse', ['options', 'usec/short', 'long items', 'usec/long',
+                      'nsec/item'], rows)
+
+@app.command
+def introspect(reps=200):
+    """Time making Commands from functions.
+
+    Commands are made with Command.from_func(). Docstrings are parsed
+    lazily, so decorating a function should cost the same however long
+    its docstring is. Reading the usage message and option summaries
+    pays for parsing it.
+
+    reps -- number of times to make each command.
+
+    """
+
+    rows = []
+    for num_opts in (10, 100):
+        for num_paras in (0, 10, 100):
+            func = _make_func('cmd', num_opts, num_paras)
+            short_names = dict(('opt_%d' % i, None) for i in range(num_opts))
+
+            def _decorate():
+                return cmdline.Command.from_func(func, dict(short_names))
+
+            def _decorate_and_read():
+                cmd = _decorate()
+                cmd.usage_msg
+                for opt in cmd.opts.values():
+                    opt.summary
+
+            # Commands made from the same function share what's parsed
+            # from its docstring, so forget it before each one.
+            clear = cmdline.clear_shared
+            rows.append((num_opts, num_paras,
+                         _time(_decorate, reps, clear) * 1000000,
+                         _time(_decorate_and_read, reps, clear) * 1000000))
+
+    _report('introspect', ['options', 'paragraphs', 'usec/decorate',
+                           'usec/read'], rows)
+
+@app.command
+def render(reps=50):
+    """Time show_help() for apps of various sizes.
+
+    Each app has the given number of commands, each with 10 options and
+    the given number of docstring paragraphs. Help for the app and for
+    one command is first rendered from scratch each time, then 'warm',
+    from the App's help cache.
+
+    reps -- number of times to show each kind of help.
+
+    """
+
+    stdout = sys.stdout
+    rows = []
+    try:
+        with open(os.devnull, 'w') as devnull:
+            sys.stdout = devnull
+            for num_cmds in (10, 100):
+                for num_paras in (0, 10):
+                    bench_app = _make_app(10, num_cmds, num_paras)
+                    bench_app.name = 'bench'
+                    clear = bench_app._help_cache.clear
+
+                    row = [num_cmds, num_paras]
+                    for cmd in (None, 'cmd'):
+                        func = lambda: bench_app.show_help(cmd)
+                        row.append(_time(func, reps, clear) * 1000)
+                        row.append(_time(func, reps) * 1000000)
+                    rows.append(tuple(row))
+    finally:
+        sys.stdout = stdout
+
+    _report('render', ['commands', 'paragraphs', 'msec/app', 'usec/app warm',
+                     'msec/cmd', 'usec/cmd warm'], rows)
+
+@app.command
+def avail(reps=20):
+    """Time listing an app's commands with get_avail_cmds().
+
+    The first listing has to parse every command's summary, which later
+    ones reuse. Fails if loading lazy commands changes how they're listed.
+
+    reps -- number of times to list the commands of each app.
+
+    """
+
+    rows = []
+    for num_cmds in (10, 100, 1000):
+        bench_apps = []
+
+        def _new_app():
+            # Forget docstrings parsed for the last app's commands.
+            cmdline.clear_shared()
+            bench_apps[:] = [_make_app(2, num_cmds, 3)]
+
+        func = lambda: bench_apps[0].get_avail_cmds()
+        rows.append((num_cmds, _time(func, reps, _new_app) * 1000,
+                     _time(func, reps) * 1000))
+
+    _report('avail', ['commands', 'msec/first', 'msec/later'], rows)
+
+    # Lazy commands must be listed the same way once they're loaded, as
+    # they all are by serve().
+    lazy_app = cmdline.App()
+    for num in range(10):
+        lazy_app.lazy_command('bench:_undocumented', name='lazy-%d' % num,
+                              summary='Do nothing, lazily.')
+
+    before = lazy_app.get_avail_cmds()
+    for name in list(lazy_app.commands):
+        lazy_app._get_cmd(name)
+
+    if lazy_app.get_avail_cmds() != before:
+        print >> sys.stderr, "Loading lazy commands changed how they're listed."
+        return 1
+
+def _undocumented():
+    pass
+
+@app.command
+def startup(reps=10):
+    """Time starting Python, and running the example apps end to end.
+
+    The example apps are also run as modules written by App.compile().
+    Every run must exit 0, so this also checks the compiled modules work.
+
+    reps -- number of times to run each.
+
+    """
+
+    dirname = os.path.dirname(os.path.abspath(cmdline.__file__))
+    hello = os.path.join(dirname, 'hello.py')
+    subcommands = os.path.join(dirname, 'subcommands.py')
+
+    compiled_dir = tempfile.mkdtemp()
+    try:
+        sys.path.insert(0, dirname)
+        import hello as hello_module
+        import subcommands as subcommands_module
+        del sys.path[0]
+
+        hello_c = os.path.join(compiled_dir, 'hello_c.py')
+        hello_module.app.compile(hello_c, 'hello.py', module='hello')
+        subcommands_c = os.path.join(compiled_dir, 'subcommands_c.py')
+        subcommands_module.app.compile(subcommands_c, 'subcommands.py',
+                                       module='subcommands')
+
+        cases = [
+            ('python', ['-c', 'pass']),
+            ('import', ['-c', 'import cmdline']),
+            ('hello', [hello]),
+            ('hello help', [hello, 'help']),
+            ('subcommands', [subcommands, 'greet']),
+            ('subcmds help', [subcommands, 'help']),
+            ('hello c', [hello_c]),
+            ('hello help c', [hello_c, 'help']),
+            ('subcmds c', [subcommands_c, 'greet']),
+            ('subcmds help c', [subcommands_c, 'help']),
+            # Global options given with help mustn't be passed to it.
+            ('hello help -p c', [hello_c, 'help', '-p']),
+            ('subcmds help -d c', [subcommands_c, 'help', '-d']),
+        ]
+
+        rows = []
+        for label, args in cases:
+            secs = _time_process([sys.executable] + args, reps)
+            rows.append((label, secs * 1000))
+    finally:
+        shutil.rmtree(compiled_dir)
+
+    _report('startup', ['run', 'msec/start'], rows)
+
+def _footprint(root):
+    """Return the number of bytes reachable from `root`, and object count.
+
+    Functions, classes and modules aren't counted or followed, so this
+    measures the data cmdline keeps about commands, not the commands
+    themselves.
+
+    """
+
+    skip = (types.FunctionType, types.MethodType, types.BuiltinFunctionType,
+            types.ModuleType, type, types.ClassType, types.CodeType)
+    seen = set()
+    stack = [root]
+    total = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, skip):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+
+        if hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+        for cls in type(obj).__mro__:
+            for slot in cls.__dict__.get('__slots__', ()):
+                if hasattr(obj, slot):
+                    stack.append(getattr(obj, slot))
+
+    return total, len(seen)
+
+# Run in a fresh interpreter by footprint() to measure peak memory.
+_RSS_SCRIPT = """
+import resource
+import sys
+import bench
+app = bench._make_app(10, int(sys.argv[1]), 1)
+app.get_avail_cmds()
+for cmd in app.commands.values():
+    for opt in cmd.opts.values():
+        opt.summary
+print resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+"""
+
+# Runs the command in its args and passes on its output. A child's peak RSS
+# starts at its parent's, so footprint() runs _RSS_SCRIPT from this small
+# interpreter, rather than straight from a bench process that other
+# benchmarks may have grown.
+_SPAWN_SCRIPT = """
+import subprocess
+import sys
+sys.stdout.write(subprocess.check_output(sys.argv[1:]))
+"""
+
+@app.command
+def footprint(num_cmds=2000):
+    """Measure the memory an app's commands take up.
+
+    Every command has the same ten options and docstring, as generated
+    commands often do. Sizes are measured right after the commands are
+    made, and again once their docstrings have been parsed for help.
+    Python 2 has no tracemalloc, so sizes are summed with sys.getsizeof()
+    over everything reachable from the App's commands. As a check, peak
+    RSS is compared between fresh interpreters with and without the
+    app, and this fails if the app didn't add to it.
+
+    num_cmds -- number of commands in the app.
+
+    """
+
+    import py_compile
+
+    dirname = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = dirname
+
+    # Compiling cmdline.py takes more memory than the app, so write the
+    # .pyc files an installed copy would have, in case they're missing.
+    for module in ('bench', 'cmdline'):
+        py_compile.compile(os.path.join(dirname, module + '.py'))
+
+    # Peak RSS with no commands is the baseline, as importing takes a
+    # few MB, and leaves some of them free for the commands to use.
+    peaks = []
+    for count in (0, num_cmds):
+        peaks.append(int(subprocess.check_output(
+            [sys.executable, '-c', _SPAWN_SCRIPT, sys.executable, '-c',
+             _RSS_SCRIPT, str(count)], env=env, cwd=dirname)))
+    rss = peaks[1] - peaks[0]
+
+    bench_app = _make_app(10, num_cmds, 1)
+    made, made_objs = _footprint(bench_app.commands)
+
+    bench_app.get_avail_cmds()
+    for cmd in bench_app.commands.values():
+        for opt in cmd.opts.values():
+            opt.summary
+    parsed, parsed_objs = _footprint(bench_app.commands)
+
+    _report('footprint', ['commands', 'bytes/cmd', 'objects/cmd',
+                          'parsed b/cmd', 'parsed o/cmd', 'peak rss kb'],
+            [(num_cmds, float(made) / num_cmds, float(made_objs) / num_cmds,
+              float(parsed) / num_cmds, float(parsed_objs) / num_cmds,
+              rss)])
+
+    if rss <= 0:
+        print >> sys.stderr, "Peak RSS didn't grow with the app's commands."
+        return 1
+
+# Run in a fresh interpreter by imports() to time importing cmdline.
+_IMPORT_SCRIPT = """
+import sys
+import time
+before = set(sys.modules)
+start = time.time()
+import cmdline
+secs = time.time() - start
+print secs
+print ' '.join(sorted(name for name in set(sys.modules) - before
+                      if sys.modules[name] is not None))
+"""
+
+@app.command
+def imports(reps=20, budget=2.0):
+    """Time importing cmdline, and fail if it takes longer than `budget`.
+
+    Every program using cmdline pays this on every run, so modules only
+    some code paths need should be imported where they're used. Each
+    import is timed in a fresh interpreter, and the fastest one counts,
+    since it has the least noise. This stands in for -X importtime,
+    which Python 2 doesn't have.
+
+    reps -- number of interpreters to time the import in.
+    budget -- most milliseconds the fastest import may take.
+
+    """
+
+    dirname = os.path.dirname(os.path.abspath(cmdline.__file__))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = dirname
+
+    times = []
+    for i in range(reps):
+        # Run from cmdline's directory, so no other cmdline.py is found.
+        output = subprocess.check_output([sys.executable, '-c',
+                                          _IMPORT_SCRIPT], env=env,
+                                         cwd=dirname)
+        secs, modules = output.split('\n', 1)
+        times.append(float(secs) * 1000)
+
+    times.sort()
+    best = times[0]
+    _report('imports', ['msec/best', 'msec/median', 'budget', 'modules'],
+            [(best, times[len(times) // 2], budget, modules.strip())])
+
+    if best > budget:
+        print >> sys.stderr, ('Importing cmdline took %.2f msec, over the '
+                              'budget of %.2f.' % (best, budget))
+        return 1
+
+@app.command
+def cache(reps=10, num_cmds=500):
+    """Time listing an app's commands with and without a MetadataCache.
+
+    Listing commands needs every command's summary. A cold start has to
+    parse every docstring and write the cache. A warm one only has to
+    read the cache.
+
+    reps -- number of times to start the app for each case.
+    num_cmds -- number of commands in the app.
+
+    """
+
+    dirname = tempfile.mkdtemp()
+    try:
+        script = _write_app(dirname, num_cmds)
+        cache_path = os.path.join(dirname, 'cache')
+        argv = [sys.executable, script, 'help']
+
+        def _remove_cache():
+            if os.path.exists(cache_path):
+                os.remove(cache_path)
+
+        results = [
+            ('no cache', _time_process(argv, reps) * 1000),
+            ('cold', _time_process(argv, reps, {'BENCH_CACHE': cache_path},
+                                   _remove_cache) * 1000),
+            ('warm', _time_process(argv, reps,
+                                   {'BENCH_CACHE': cache_path}) * 1000),
+        ]
+    finally:
+        shutil.rmtree(dirname)
+
+    _report('cache', ['start', 'msec/start'], results)
+
+@app.command
+def convert(reps=5, num_values=100000):
+    """Time converting lazy varargs one at a time and all at once.
+
+    reps -- number of times to parse and convert argv for each converter.
+    num_values -- number of values in argv.
+
+    """
+
+    argv = ['bench'] + [str(i) for i in xrange(num_values)]
+
+    rows = []
+    for name, converter in [('none', None), ('int', int),
+                            ('ndarray', cmdline.ndarray('int64'))]:
+        bench_app = cmdline.App(arg_types={'values': converter})
+
+        @bench_app.main(lazy_varargs='values')
+        def total(values):
+            pass
+
+        def _parse_and_convert():
+            cmd, args, opts = bench_app._parse_argv(argv)
+            bench_app._convert_inputs(cmd, args, opts)
+            values = args[-1]
+            if iter(values) is values:
+                # These are converted as they're read.
+                for value in values:
+                    pass
+
+        secs = _time(_parse_and_convert, reps)
+        rows.append((name, secs * 1000, secs * 1000000000 / num_values))
+
+    _report('convert', ['converter', 'msec/argv', 'nsec/value'], rows)
+
+@app.command
+def output(reps=3, num_lines=200000):
+    """Time writing a command's output with print and by returning it.
+
+    Returned output is timed as text lines, and as rows in each format
+    --format offers. Output goes to /dev/null, so only the cost of
+    producing it counts.
+
+    reps -- number of times to run each command.
+    num_lines -- number of lines each command writes.
+
+    """
+
+    bench_app = cmdline.App()
+
+    @bench_app.command
+    def prints():
+        for i in xrange(num_lines):
+            print 'line %d' % i
+
+    @bench_app.command
+    def yields():
+        for i in xrange(num_lines):
+            yield 'line %d' % i
+
+    @bench_app.command
+    def records():
+        for i in xrange(num_lines):
+            yield {'id': i, 'name': 'line', 'score': 0.5}
+
+    cases = [('prints', 'text'), ('yields', 'text')]
+    cases.extend(('records', output_format)
+                 for output_format in sorted(cmdline._OUTPUT_FORMATS))
+
+    rows = []
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        for name, output_format in cases:
+            bench_app.output_format = output_format
+            sys.stdout = devnull
+            try:
+                secs = _time(lambda: bench_app._run(['bench', name]), reps)
+            finally:
+                sys.stdout = stdout
+
+            rows.append((name, output_format, secs * 1000,
+                         secs * 1000000000 / num_lines))
+
+    _report('output', ['command', 'format', 'msec/run', 'nsec/line'], rows)
+
+# Script run by the batch benchmark. Its output isn't ASCII, to check each
+# batch mode captures and writes it the same way.
+_BATCH_SCRIPT = '''
+import cmdline
+
+app = cmdline.App()
+
+@app.command
+def greet(name):
+    print u'Hall\\xe5, %s!' % name
+
+if __name__ == '__main__':
+    app.run()
+'''
+
+@app.command
+def batch(reps=3, num_lines=2000):
+    """Time running a --batch file serially, with --jobs, and on threads.
+
+    Every mode's output must match the serial run's, so this fails if a
+    mode garbles or chokes on output, as it would on non-ASCII unicode.
+
+    reps -- number of times to run the batch in each mode.
+    num_lines -- number of lines in the batch file.
+
+    """
+
+    dirname = tempfile.mkdtemp()
+    try:
+        script_path = os.path.join(dirname, 'batch_app.py')
+        with open(script_path, 'w') as script:
+            script.write(_BATCH_SCRIPT)
+
+        batch_path = os.path.join(dirname, 'batch.txt')
+        with open(batch_path, 'w') as batch_file:
+            for i in xrange(num_lines):
+                batch_file.write('greet %d\n' % i)
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.path.dirname(os.path.abspath(cmdline.__file__))
+        env['PYTHONIOENCODING'] = 'utf-8'
+
+        modes = [('serial', []), ('jobs', ['--jobs', '2']),
+                 ('threads', ['--jobs', '2', '--threads'])]
+        rows = []
+        expected = None
+        for mode, switches in modes:
+            argv = [sys.executable, script_path, '--batch',
+                    batch_path] + switches
+            output = subprocess.check_output(argv, env=env)
+            if expected is None:
+                expected = output
+            elif output != expected:
+                print >> sys.stderr, ("--batch output with %s didn't match "
+                                      "the serial run's." % ' '.join(switches))
+                return 1
+
+            secs = _time_process(argv, reps, env)
+            rows.append((mode, secs * 1000, secs * 1000000 / num_lines))
+    finally:
+        shutil.rmtree(dirname)
+
+    _report('batch', ['mode', 'msec/batch', 'usec/line'], rows)
+
+@app.command
+def suite():
+    """Run every benchmark with its default settings."""
+
+    exit_code = 0
+    for bench in (parse, introspect, render, avail, startup, imports,
+                  footprint, cache, convert, output, batch):
+        exit_code = max(exit_code, bench())
+
+    return exit_code
+
+if __name__ == '__main__':
+    app.run()
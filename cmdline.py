@@ -10,11 +10,18 @@ For now, see hello.py for a simple example.
 """
 
 # Standard library imports.
-import inspect
+# Modules only some code paths need, like inspect, textwrap and shlex, are
+# imported where they're used, since every program using this one pays for
+# what's imported here on every run.
+import cStringIO
+import errno
+import itertools
+import marshal
 import os
 import re
+import signal
 import sys
-import textwrap
+import time
 import types
 
 # Module constants.
@@ -24,8 +31,32 @@ import types
 _USAGE_ERR_CODE = 2
 
 # Used to recognize PEP 257-style function arg descriptions in
-# docstrings.
-_PEP_257_RE = re.compile(r'^(\w+) --')
+# docstrings. It's left to the re module to compile and cache, so it's
+# only compiled if a docstring is parsed.
+_PEP_257_RE = r'^(\w+) --'
+
+# Marks lazily-computed attributes that haven't been computed yet.
+_UNPARSED = object()
+
+# Objects shared between Commands made from similar functions. See _share().
+_shared = {}
+
+# Counts changes to the usage messages and summaries of Commands and Args.
+# It's part of the key App.format_help() caches help under, since they
+# don't know which App they belong to, to clear its cache.
+_doc_changes = 0
+
+# Clock for timing events reported to App hooks. Python 2 has no monotonic
+# clock, so fall back on time.time() there.
+_clock = getattr(time, 'monotonic', time.time)
+
+# Switches handled by App.run() itself, mapped to whether they take a value.
+# None means they take one only if it's given as '--switch=value'.
+_APP_SWITCHES = {'batch': True, 'format': True, 'jobs': True, 'profile': None,
+                 'serve': True, 'threads': False}
+
+# Number of functions --profile lists when not writing stats to a file.
+_PROFILE_TOP_N = 25
 
 class InvalidInput(Exception):
     """Indicates that invalid input was given.
@@ -88,6 +119,21 @@ class InvalidOption(InvalidInput):
         self.name = name
         self.input = value
 
+class InvalidArg(InvalidInput):
+    """Indicates that an argument's value could not be converted.
+
+    self.name is the argument name.
+    self.input is the invalid value.
+    self.position is the value's position among the command's args,
+    counting from 1, for values of *varargs. Otherwise it's None.
+
+    """
+
+    def __init__(self, name, value=None, position=None):
+        self.name = name
+        self.input = value
+        self.position = position
+
 class DuplicateOption(InvalidInput):
     """Indicates that this option has already been passed."""
 
@@ -107,6 +153,18 @@ class InvalidFlag(InvalidOption):
         self.name = name
         self.input = value
 
+class TooManyRepeats(InvalidInput):
+    """Indicates that a repeatable option was given too many times.
+
+    self.input is the option's name.
+    self.max_repeats is the number of times it may be given.
+
+    """
+
+    def __init__(self, name, max_repeats):
+        self.input = name
+        self.max_repeats = max_repeats
+
 class InvalidShortName(InvalidInput):
     """Indicates that two short option names collide.
 
@@ -123,6 +181,30 @@ class InvalidShortName(InvalidInput):
         self.opt_one = opt_one
         self.opt_two = opt_two
 
+class BadResponseFile(InvalidInput):
+    """Indicates that a response file could not be read.
+
+    self.input is the response file's path.
+    self.reason is a string explaining what went wrong.
+
+    """
+
+    def __init__(self, path, reason):
+        self.input = path
+        self.reason = reason
+
+class BadBatchFile(InvalidInput):
+    """Indicates that a --batch file could not be read.
+
+    self.input is the batch file's path.
+    self.reason is a string explaining what went wrong.
+
+    """
+
+    def __init__(self, path, reason):
+        self.input = path
+        self.reason = reason
+
 def _get_usage_msg(docstr):
     """Parse `docstr` and return a usage message.
 
@@ -149,7 +231,7 @@ def _get_usage_msg(docstr):
         # GRIPE This is a lot like the code for getting param summaries -
         # should they be merged for DRYness, or would that hurt readability
         # too much?
-        match = _PEP_257_RE.match(para)
+        match = re.match(_PEP_257_RE, para)
         if para.startswith('>>>') or (para.startswith('@param') or
                                       para.startswith(':param') or
                                       match is not None):
@@ -199,7 +281,7 @@ def _get_param_summaries(docstr):
     param_summary = None
     blank_line_seen = False
     for line in docstr.splitlines():
-        match = _PEP_257_RE.match(line)
+        match = re.match(_PEP_257_RE, line)
         if match is not None:
             param_name = match.groups()[0]
             remainder = line[match.end():].strip()
@@ -234,356 +316,2807 @@ def _get_param_summaries(docstr):
 
     return summaries
 
-class Arg(object):
-    """An argument for a command-line app."""
-
-    def __init__(self, name, summary, default=None, type_converter=None):
+# Flags set in a code object's co_flags by *args and **kwargs.
+_CO_VARARGS = 0x04
+_CO_VARKEYWORDS = 0x08
 
-        self.name = name
-        self.summary = summary
-        self.default = default
-        self.type_converter = type_converter
+def _get_argspec(func):
+    """Return (args, varargs, keywords, defaults) for function `func`.
 
-    def format_name(self):
-        """Return a string representing this argument's name."""
+    This is what inspect.getargspec() returns, but works it out from
+    func's code object directly, so making a Command doesn't mean
+    importing inspect.
 
-        return self.name
+    func -- a function or method.
 
-    def convert_type(self, val):
-        """Return `val` after converting it to this Arg's type."""
+    """
 
-        if val is not None and self.type_converter is not None:
-            val = self.type_converter(val)
+    func = getattr(func, 'im_func', func)
+    code = func.func_code
 
-        return val
+    names = code.co_varnames
+    num_args = code.co_argcount
+    args = list(names[:num_args])
 
-    def format_summary(self, width=70):
-        """Return a formatted summary of `self`.
+    varargs = None
+    if code.co_flags & _CO_VARARGS:
+        varargs = names[num_args]
+        num_args += 1
 
-        Return `self.format_name()` if no summary is available.
+    varkw = None
+    if code.co_flags & _CO_VARKEYWORDS:
+        varkw = names[num_args]
 
-        width -- Optional max width of a line in result. Defaults to 70.
+    return args, varargs, varkw, func.func_defaults
 
-        """
+def _exit_status(exc):
+    """Return the exit status Python would give for SystemExit `exc`."""
 
-        summary = ''
-        name = self.format_name()
+    code = exc.code
+    if code is None:
+        return 0
+    elif type(code) is not int:
+        # Do what Python does with sys.exit('message').
+        print >> sys.stderr, code
+        return 1
 
-        if self.summary is None:
-            return '  ' + name
+    return code
 
-        for line in self.summary.splitlines():
-            if line is not '':
-                summary += textwrap.fill(line, width,
-                                         initial_indent=' ' * 6,
-                                         subsequent_indent=' ' * 6)
-            else:
-                summary += os.linesep * 2
+def _get_term_columns(stream):
+    """Return the width of the terminal `stream` is attached to, or None."""
 
-        return '  %s%s%s' % (name, os.linesep, summary)
+    try:
+        import fcntl
+        import struct
+        import termios
 
-class Option(Arg):
-    """An option for a command-line app."""
+        packed = fcntl.ioctl(stream.fileno(), termios.TIOCGWINSZ, '\0' * 4)
+        return struct.unpack('hh', packed)[1] or None
+    except (ImportError, AttributeError, IOError, ValueError):
+        # Not a terminal, or not a platform where we can tell.
+        return None
 
-    def __init__(self, name, summary, default, short_name=None,
-                 type_converter=None):
-        self.name = name
-        self.default = default
-        self.summary = summary
-        self.short_name = name[0] if short_name is None else short_name
-        self.type_converter = type_converter
+def _get_term_width(stream, default=70, max_width=79):
+    """Return the width to wrap help text to when writing to `stream`.
 
-    def format_name(self):
-        """Return this Option's name(s) as a string."""
+    $COLUMNS is used if it's set. Otherwise, if `stream` is a terminal,
+    its width is asked for. Lines are kept a column short of the edge,
+    and no longer than `max_width`, as very long lines are hard to read.
 
-        result = ''
-        if self.short_name is not None:
-            result += '-%s, ' % self.short_name
+    stream -- file object the text will be written to.
+    default -- width to use if no width can be found. Defaults to 70.
+    max_width -- maximum width to return. Defaults to 79.
 
-        result += '--%s' % self.name
+    """
 
-        return result
+    columns = os.environ.get('COLUMNS')
+    if columns is None:
+        columns = _get_term_columns(stream)
 
-    @property
-    def is_flag(self):
-        """Return True if this Option is a flag. Return False otherwise."""
+    try:
+        columns = int(columns)
+    except (TypeError, ValueError):
+        return default
 
-        return type(self.default) is types.BooleanType
+    if columns < 2:
+        return default
 
-class Command(object):
-    """A sub-command in a command-line app.
+    return min(columns - 1, max_width)
 
-    These are best created by decorating functions with App.command() or
-    App.main().
+class _LRUCache(object):
+    """A mapping that holds at most `maxsize` items.
 
-    Using this class directly would work, but it wouldn't be as pretty.
+    When it's full, adding an item drops the least recently used one.
 
     """
 
-    # GRIPE You could argue that __init__ should actually just be
-    # from_func. I'm not sure if you'd be right or not.
-    def __init__(self, func, args, opt_args, opts, arg_types=None,
-                 usage_msg=None, name=None):
-        """Make a new Command.
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        # Replaced by an OrderedDict on the first put(), so a cache that's
+        # never filled never imports collections.
+        self._items = {}
 
-        func -- callable that does the command's work.
-        args -- list of required positional args for this command.
-        opt_args -- list of optional positional args for this command.
-        opts -- dict of options for this command. Options map a name to a
-            (required) passed value (with an optional short name).
-        usage_msg -- Optional string explaining the command. Defaults to
-            None.
-        name -- Optional command name. If None, self.name is set by
-            replacing '_' with '-' in func.__name__.
+    def __len__(self):
+        return len(self._items)
 
-        """
+    def get(self, key, default=None):
+        """Return the item for `key`, or `default` if there isn't one."""
 
-        self.func = func
-        self.name = func.__name__.replace('_', '-') if name is None else name
-        self.args = args
-        self.opt_args = opt_args
-        self.opts = opts
-        self.usage_msg = usage_msg
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            return default
 
-        summary = None
-        if usage_msg is not None:
-            summary = self.usage_msg
-            end_idx = summary.find('.')
-            if end_idx > 0:
-                summary = summary[0:end_idx + 1]
-        self.summary = summary
+        # Re-inserting marks it as the most recently used.
+        self._items[key] = value
 
-        self.short_names = {}
-        for key, value in self.opts.items():
-            if value.short_name in self.short_names:
-                raise InvalidShortName(self.name, value.short_name,
-                                       self.short_names[value.short_name],
-                                       value.name)
+        return value
 
-            self.short_names[value.short_name] = key
+    def put(self, key, value):
+        """Store `value` under `key`, dropping the oldest item if full."""
 
-    @property
-    def min_argc(self):
-        """Minimum number of args to this Command."""
+        if not self._items:
+            import collections
+            self._items = collections.OrderedDict()
 
-        return len(self.args)
+        self._items.pop(key, None)
+        self._items[key] = value
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
 
-    @property
-    def max_argc(self):
-        """Maximum number of args to this Command."""
+    def clear(self):
+        """Remove all items."""
 
-        return len(self.args) + len(self.opt_args)
+        self._items.clear()
 
-    def run(self, args, kwargs):
-        """Run this command using args and kwargs."""
+def cached(converter, maxsize=128):
+    """Return a version of type converter `converter` that caches results.
 
-        return self.func(*args, **kwargs)
+    Batch and server runs often convert the same values over and over,
+    so converters that do real work, like looking things up, can be
+    wrapped to do it once per value:
 
-    @classmethod
-    def from_func(cls, func, short_names=None, opt_args=None, arg_types=None,
-                  usage_msg=None, name=None):
-        """Get an instance of Command by introspecting func.
+    >>> app = cmdline.App(arg_types={'when': cmdline.cached(parse_date)})
 
-        func -- a callable object.
-        short_names -- a dict mapping long option names to single letters.
-        opt_args -- a list of func's optional params that should be
-                    treated as optional command-line args instead of
-                    options.
-        arg_types -- optional dict mapping arg names to callables that
-                     take a string as input and either return an object
-                     of the desired type or raise a ValueError.
-        usage_msg -- an optional string explaining the command. Defaults
-                     to a processed version of func's docstring.
-        name -- an optional name for the command. Defaults to a
-                transformed version of `func`'s name.
+    The result works anywhere a converter does. It keeps the results
+    for the `maxsize` most recently used values, and counts cache hits
+    and misses in its `hits` and `misses` attributes. Values that
+    raise ValueError are not cached.
 
-        """
+    """
 
-        if opt_args is None:
-            # GRIPE It might be better to go through and make default
-            # opt_args an empty list everywhere.
-            opt_args = []
+    return _CachedConverter(converter, maxsize)
 
-        if arg_types is None:
-            arg_types = {}
+class _CachedConverter(object):
+    """A type converter that remembers what it returned. See cached()."""
 
-        # Grab any param summary from the docstring.
-        docstr = inspect.getdoc(func)
-        summaries = {}
-        if docstr is not None:
-            # GRIPE We should probably let you pass param summaries from
-            # outside.
-            summaries = _get_param_summaries(docstr)
-            if usage_msg is None:
-                usage_msg = _get_usage_msg(docstr)
+    def __init__(self, converter, maxsize):
+        import threading
 
-        # Inspect func for hard data.
-        func_args, varargs, varkw, defaults = inspect.getargspec(func)
-        if inspect.ismethod(func):
-            # Do not include the self/cls parameter.
-            func_args = func_args[1:]
-        num_defaults = 0 if defaults is None else len(defaults)
-        num_func_args = 0 if func_args is None else len(func_args) - num_defaults
-        func_name = func.__name__
+        self.converter = converter
+        self.hits = 0
+        self.misses = 0
+        self._cache = _LRUCache(maxsize)
+        # Batch lines may be converted on several threads at once.
+        self._lock = threading.Lock()
 
-        # Build required arg dict.
-        arg_list = func_args[:num_func_args]
-        args = []
-        for arg in arg_list:
-            summary = summaries.get(arg)
-            type_converter = arg_types.get(arg)
-            arg_name = arg.replace('_', '-')
+        # Look like the converter, so App.compile() can find this by name
+        # if it replaces the converter in its module.
+        for attr in ('__module__', '__name__', '__doc__'):
+            if hasattr(converter, attr):
+                setattr(self, attr, getattr(converter, attr))
 
-            args.append(Arg(arg_name, summary, type_converter=type_converter))
+    def __call__(self, value):
+        try:
+            with self._lock:
+                result = self._cache.get(value, _UNPARSED)
+                if result is not _UNPARSED:
+                    self.hits += 1
+                    return result
+                self.misses += 1
+        except TypeError:
+            # Unhashable values can't be cached.
+            return self.converter(value)
+
+        result = self.converter(value)
+        with self._lock:
+            self._cache.put(value, result)
 
-        # Build optional arg list and options dict.
-        opts = {}
-        for i, arg in enumerate(func_args[num_func_args:]):
-            short_name = None
-            if short_names is not None:
-                tmp = short_names.get(arg)
-                if tmp is not None and len(tmp) == 1:
-                    short_name = tmp
+        return result
 
-            summary = summaries.get(arg)
+    def clear(self):
+        """Forget all cached results, and reset the hit and miss counts."""
 
-            if arg in opt_args:
-                pos = opt_args.index(arg)
-                type_converter = arg_types.get(arg)
-                arg_name = arg.replace('_', '-')
-                opt_args[pos] = Arg(arg_name, summary, defaults[i],
-                                    type_converter)
+        with self._lock:
+            self._cache.clear()
+            self.hits = self.misses = 0
 
-                continue
+def ndarray(dtype):
+    """Return a type converter that makes arrays of numbers of `dtype`.
 
-            type_converter = arg_types.get(arg)
-            opt_name = arg.replace('_', '-')
-            opts[arg] = Option(opt_name, summary, defaults[i], short_name,
-                               type_converter)
+    For lazy varargs and repeatable options, it converts all of the
+    values at once, in one vectorized step, rather than calling a
+    converter for each:
 
-        return cls(func, args, opt_args, opts, arg_types, usage_msg, name)
+    >>> @app.command(arg_types={'weights': cmdline.ndarray('float64')},
+    ...              lazy_varargs='weights')
+    ... def fit(weights):
 
-class App(object):
-    """A command-line application."""
+    The result is a NumPy array if NumPy is installed, or an array.array
+    otherwise. Used for a single arg or option, it converts a
+    comma-separated list, like '1,2,3'. It can't be used for *varargs,
+    as Python would unpack the array into a tuple.
 
-    def __init__(self, usage_msg=None, arg_types={}, opt_args=[]):
-        """Create an App.
+    dtype -- a NumPy dtype, or the name of one. Without NumPy, it must
+             be int, float, or one of the names in _ARRAY_TYPECODES.
 
-        usage_msg -- optional string explaining this App to an end-user.
-                     PEP 257 says docstrings should be usable as a
-                     command-line module's usage statement, so this is
-                     usually __doc__.
+    """
 
-                     Anything that looks like a parameter description
-                     will be removed.
+    return _NDArrayConverter(dtype)
 
-        arg_types -- optional dict mapping arg names to callables that
-                     take a string as input and either return an object
-                     of the desired type or raise a ValueError.
+# array.array typecodes to use for NumPy dtypes when NumPy isn't installed.
+_ARRAY_TYPECODES = {
+    'int8': 'b', 'uint8': 'B', 'int16': 'h', 'uint16': 'H', 'int32': 'i',
+    'uint32': 'I', 'int64': 'l', 'uint64': 'L', 'float32': 'f',
+    'float64': 'd', 'int': 'l', 'float': 'd', int: 'l', float: 'd',
+}
 
-        opt_args -- optional list of arg names that should be treated as
-                    optional args instead of options.
+class _NDArrayConverter(object):
+    """A type converter that makes arrays of numbers. See ndarray().
 
-        """
+    Anything with a convert_all() method like this one's is used to
+    convert all of an arg's values at once.
 
-        self.cmd = None
+    """
 
-        self.arg_types = arg_types
-        self.opt_args = opt_args
-        self.main_cmd = None
-        self.commands = {}
-        self.name = None
-        self.argv = []
+    def __init__(self, dtype):
+        self.dtype = dtype
 
-        if usage_msg is not None:
-            usage_msg = _get_usage_msg(usage_msg).strip()
+        # The numpy module, or None if it isn't installed. Looked up when
+        # first needed, as importing it is slow.
+        self._numpy = _UNPARSED
 
-        self.usage_msg = usage_msg
+    def __call__(self, value):
+        return self.convert_all(value.split(','))
 
-        # Stores the globals dict for whatever module this app was created in.
-        self.module_globals = None
-        self.global_opts = {}
+    def convert_all(self, values):
+        """Return list of strings `values`, converted to an array.
 
-        # Fields that support the main() and command() decorators.
-        # They hold whatever args were passed to the decorators.
+        If a value can't be converted, raises a ValueError whose `index`
+        attribute is the index of the value.
 
-        # GRIPE They also have utterly lousy names. '_dec' stands for
-        # 'decorator', but I keep forgetting that. Find a better one. Or put
-        # these in a single dict, which would probably be simpler.
-        self._dec_short_names = None
-        self._dec_opt_args = None
-        self._dec_main_cmd = None
-        self._dec_arg_types = None
-        self._dec_usage_msg = None
+        """
 
-    @property
-    def has_subcmds(self):
-        """Boolean indicating whether this app has subcommands."""
+        if self._numpy is _UNPARSED:
+            try:
+                import numpy
+            except ImportError:
+                numpy = None
+            self._numpy = numpy
 
-        return len(self.commands) > 0
+        if self._numpy is not None:
+            dtype = self._numpy.dtype(self.dtype)
+            try:
+                return self._numpy.array(values, dtype)
+            except (ValueError, TypeError, OverflowError):
+                self._find_invalid(values, dtype.type)
+                raise
 
-    def _cmd_decorator(self, func):
-        """Do the work of decorating func as a command.
+        import array
 
-        Interprets private fields that store any params passed to the
-        actual decorators.
+        typecode = _ARRAY_TYPECODES.get(self.dtype)
+        if typecode is None:
+            raise TypeError('dtype %r needs NumPy.' % (self.dtype,))
 
-        This exists so we can mostly hide the different behavior
-        of decorators with args vs. decorators without args from the end
-        user.
+        convert = float if typecode in 'fd' else int
+        try:
+            return array.array(typecode, map(convert, values))
+        except (ValueError, TypeError, OverflowError):
+            self._find_invalid(values, lambda val: array.array(typecode,
+                                                               [convert(val)]))
+            raise
+
+    @staticmethod
+    def _find_invalid(values, convert):
+        """Raise a ValueError for the first of `values` convert() rejects."""
+
+        for index, val in enumerate(values):
+            try:
+                convert(val)
+            except (ValueError, TypeError, OverflowError):
+                exc = ValueError('invalid value %r' % (val,))
+                exc.index = index
+                raise exc
+
+class _Input(object):
+    """Base class for type converters whose values hold files open.
+
+    Subclasses define close(), to release the file. Command.run() closes
+    values that are instances of this once the command returns.
 
-        Really, we just want to avoid having two decorators with
-        virtually identical names for a single purpose. Who really wants
-        to worry about App.command() vs. App.command_args()?
+    """
 
-        We achieve this by requiring all args to our decorators to be
-        passed as keyword arguments. That's a little noxious, but I
-        think it's better than having two differently-named decorators
-        for what looks to a user like the same task.
+    __slots__ = ()
 
-        """
+    # Compiled apps can't import cmdline to check isinstance(), so they
+    # look for this instead.
+    _close_after_run = True
 
-        short_names = self._dec_short_names
-        opt_args = self._dec_opt_args
-        usage_msg = self._dec_usage_msg
+    def __enter__(self):
+        return self
 
-        # Merge self.arg_types with the command's arg_types, deferring to the
-        # command's data.
-        arg_types = dict(self.arg_types)
-        if self._dec_arg_types is not None:
-            arg_types.update(self._dec_arg_types)
+    def __exit__(self, *exc_info):
+        self.close()
 
-        if len(self.opt_args) > 0:
-            if opt_args is not None:
-                opt_args.extend(self.opt_args)
-            else:
-                opt_args = self.opt_args[:]
-        cmd = Command.from_func(func, short_names, opt_args, arg_types,
-                                usage_msg)
+class MappedFile(_Input):
+    """A type converter that maps a file into memory, read-only.
 
-        if self._dec_main_cmd is True:
-            # This is the main command.
-            self.main_cmd = cmd
-        else:
-            # This is a subcommand.
-            self.commands[cmd.name] = cmd
+    Use it as an arg type to work on files without reading them in:
 
-        if 'help' not in self.commands:
-            # Add a 'help' command.
-            help_cmd = Command.from_func(self.show_help, name='help',
-                                         opt_args=['cmd'])
-            self.commands[help_cmd.name] = help_cmd
+    >>> app = cmdline.App(arg_types={'log': cmdline.MappedFile})
 
-        # Empty state-transfer fields for next call.
-        self._dec_short_names = None
-        self._dec_opt_args = None
-        self._dec_arg_types = None
-        self._dec_usage_msg = None
+    The command gets a MappedFile, which supports len(), indexing and
+    slicing. Its `mmap` attribute is the underlying mmap, for things
+    like find() and regex searches, and `name` is the path it was
+    given. '-' maps stdin, if stdin is redirected from a file. The file
+    is unmapped when the command returns.
 
-        return func
+    """
 
-    def main(self, func=None, short_names=None, opt_args=None, arg_types=None):
-        """Decorator to make func the main command for this app.
+    __slots__ = ('name', 'mmap')
+
+    def __init__(self, path):
+        import mmap
+        import stat
+
+        self.name = path
+        self.mmap = None
+
+        try:
+            if path == '-':
+                size = self._map(sys.stdin.fileno(), mmap, stat)
+            else:
+                with open(path, 'rb') as in_file:
+                    # mmap dups the descriptor, so the file can be closed.
+                    size = self._map(in_file.fileno(), mmap, stat)
+        except EnvironmentError:
+            raise ValueError('could not map %r' % path)
+
+        if size is None:
+            raise ValueError('%r is not a regular file' % path)
+
+    def _map(self, fileno, mmap, stat):
+        """Map `fileno` and return its size, or None if it can't be mapped.
+
+        mmap and stat are the modules, which are imported lazily.
+
+        """
+
+        info = os.fstat(fileno)
+        if not stat.S_ISREG(info.st_mode):
+            return None
+
+        if info.st_size == 0:
+            # mmap refuses to map empty files.
+            self.mmap = ''
+        else:
+            self.mmap = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+
+        return info.st_size
+
+    def __len__(self):
+        return len(self.mmap)
+
+    def __getitem__(self, index):
+        return self.mmap[index]
+
+    def close(self):
+        """Unmap the file."""
+
+        if self.mmap:
+            self.mmap.close()
+
+class InputStream(_Input):
+    """A type converter that opens a file for buffered binary reading.
+
+    Use it as an arg type to stream through files a chunk at a time:
+
+    >>> app = cmdline.App(arg_types={'log': cmdline.InputStream})
+
+    The command gets an InputStream, which has read(), readinto() and
+    readline() and iterates over lines. Its `file` attribute is the
+    underlying io.BufferedReader, and `name` is the path it was given.
+    '-' reads stdin. The file is closed when the command returns, except
+    for stdin, which is left open.
+
+    """
+
+    __slots__ = ('name', 'file')
+
+    # Bigger than io's default, since inputs may be huge.
+    buffer_size = 1 << 20
+
+    def __init__(self, path):
+        import io
+
+        self.name = path
+        try:
+            if path == '-':
+                self.file = io.open(sys.stdin.fileno(), 'rb',
+                                    self.buffer_size, closefd=False)
+            else:
+                self.file = io.open(path, 'rb', self.buffer_size)
+        except EnvironmentError:
+            raise ValueError('could not open %r' % path)
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def readinto(self, buf):
+        return self.file.readinto(buf)
+
+    def readline(self, limit=-1):
+        return self.file.readline(limit)
+
+    def __iter__(self):
+        return iter(self.file)
+
+    def close(self):
+        """Close the file."""
+
+        self.file.close()
+
+class _DocInfo(object):
+    """The usage message and param summaries in a docstring.
+
+    Only help and error messages need these, so parsing the docstring
+    is put off until one of them is asked for. The result is kept.
+
+    """
+
+    __slots__ = ('_func', '_docstr', '_cache', '_parsed')
+
+    def __init__(self, func=None, docstr=None, cache=None):
+        """Make a new _DocInfo.
+
+        func -- optional function whose docstring should be parsed.
+        docstr -- optional docstring to parse, if `func` is None.
+        cache -- optional MetadataCache to look `func` up in.
+
+        """
+
+        self._func = func
+        self._docstr = docstr
+        self._cache = cache
+        self._parsed = None
+
+    def _parse(self):
+        """Return (usage_msg, summaries), parsing them if need be."""
+
+        if self._parsed is not None:
+            return self._parsed
+
+        func = self._func
+        cache = self._cache if func is not None else None
+
+        parsed = None if cache is None else cache.get(func)
+        if parsed is None:
+            docstr = self._docstr
+            if func is not None:
+                import inspect
+                docstr = inspect.getdoc(func)
+
+            # GRIPE We should probably let you pass param summaries from
+            # outside.
+            parsed = (_get_usage_msg(docstr), _get_param_summaries(docstr))
+            if cache is not None:
+                cache.set(func, *parsed)
+
+        self._parsed = parsed
+        self._func = self._docstr = self._cache = None
+
+        return parsed
+
+    @property
+    def usage_msg(self):
+        """The docstring's usage message, or None if it has none."""
+
+        return self._parse()[0]
+
+    @property
+    def summaries(self):
+        """Dict mapping param names to their summaries."""
+
+        return self._parse()[1]
+
+# Kinds of token yielded by _ArgvTokenizer.
+_LONG_OPT = 'long option'
+_SHORT_OPTS = 'short options'
+_END_OPTS = 'end of options'
+_POSITIONAL = 'positional'
+
+class _ArgvTokenizer(object):
+    """Split command-line inputs into typed tokens.
+
+    Iterating over an _ArgvTokenizer yields (kind, value) pairs, where
+    kind is one of:
+
+    * _LONG_OPT - value is what followed '--', e.g. 'name=val'.
+    * _SHORT_OPTS - value is what followed '-', e.g. 'abc'.
+    * _END_OPTS - value is '--'. Everything after it is _POSITIONAL.
+    * _POSITIONAL - value is the input, unchanged.
+
+    Inputs are read one at a time, only as tokens are asked for, so
+    nothing is copied and any iterable of strings will do.
+
+    """
+
+    def __init__(self, inputs):
+        """Make a new _ArgvTokenizer.
+
+        inputs -- iterable of strings, not including the program name.
+
+        """
+
+        self._inputs = iter(inputs)
+        self._literal = False
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        """Return the next (kind, value) token."""
+
+        item = next(self._inputs)
+
+        if self._literal:
+            return _POSITIONAL, item
+        elif item == '--':
+            self._literal = True
+            return _END_OPTS, item
+        elif item.startswith('--'):
+            return _LONG_OPT, item[2:]
+        elif item.startswith('-') and item != '-':
+            return _SHORT_OPTS, item[1:]
+        else:
+            return _POSITIONAL, item
+
+    def value(self, name):
+        """Return the next input, untokenized, as the value of option `name`.
+
+        Raises InvalidOption if there are no inputs left.
+
+        """
+
+        try:
+            return next(self._inputs)
+        except StopIteration:
+            raise InvalidOption(name)
+
+    def rest(self):
+        """Return an iterator over the inputs left, untokenized."""
+
+        return self._inputs
+
+# How much of a response file to read at a time.
+_RESPONSE_CHUNK_SIZE = 64 * 1024
+
+def _expand_response_files(inputs, _open_paths=()):
+    """Yield `inputs`, replacing each '@path' with the inputs in `path`.
+
+    A response file holds one input per line, or, if it has any NUL
+    characters, one input per NUL-terminated record, as written by
+    'find -print0'. Empty inputs are skipped. '@-' reads stdin. Inputs in
+    a response file can name other response files.
+
+    Files are read a chunk at a time, as inputs are asked for, so a
+    response file listing millions of paths is never all in memory.
+
+    Raises BadResponseFile if a response file can't be read, or names
+    one that is already being read.
+
+    inputs -- iterable of strings.
+    _open_paths -- real paths of the response files being read, which
+                   the ones in `inputs` were found in.
+
+    """
+
+    for item in inputs:
+        if not item.startswith('@') or item == '@':
+            yield item
+            continue
+
+        path = item[1:]
+        real_path = path if path == '-' else os.path.realpath(path)
+        if real_path in _open_paths:
+            raise BadResponseFile(path, 'it includes itself')
+
+        try:
+            in_file = sys.stdin if path == '-' else open(path, 'rb')
+        except IOError as exc:
+            raise BadResponseFile(path, exc.strerror)
+
+        try:
+            for nested in _expand_response_files(_read_response_file(in_file),
+                                                 _open_paths + (real_path,)):
+                yield nested
+        finally:
+            if in_file is not sys.stdin:
+                in_file.close()
+
+def _read_response_file(in_file):
+    """Yield the inputs in response file `in_file`.
+
+    See _expand_response_files() for the format.
+
+    """
+
+    chunk = in_file.read(_RESPONSE_CHUNK_SIZE)
+    if '\0' not in chunk:
+        # One input per line.
+        lines = itertools.chain(chunk.splitlines(True), in_file)
+        partial = ''
+        for line in lines:
+            # The first chunk may end partway through a line.
+            if not line.endswith('\n'):
+                partial += line
+                continue
+
+            line = (partial + line).rstrip('\r\n')
+            partial = ''
+            if line:
+                yield line
+
+        if partial:
+            yield partial
+
+        return
+
+    rest = ''
+    while chunk:
+        records = (rest + chunk).split('\0')
+        rest = records.pop()
+        for record in records:
+            if record:
+                yield record
+
+        chunk = in_file.read(_RESPONSE_CHUNK_SIZE)
+
+    if rest:
+        yield rest
+
+def _intern(string):
+    """Return the interned copy of `string`, if it's a byte string."""
+
+    return intern(string) if type(string) is str else string
+
+def _share(key, make):
+    """Return the object shared under `key`, calling make() to make it.
+
+    Commands made from functions with the same docstring and params
+    share their Args, Options and option dicts, rather than each having
+    copies. This saves a lot of memory in apps with many generated
+    commands. Shared Args, Options and dicts are read-only, so changing
+    one command can't change others. See clear_shared().
+
+    If `key` can't be hashed, a new, unshared object is returned.
+
+    """
+
+    try:
+        obj = _shared.get(key)
+    except TypeError:
+        return make()
+
+    if obj is None:
+        obj = _shared[key] = make()
+
+    return obj
+
+def clear_shared():
+    """Stop sharing what's been made for Commands with Commands made later.
+
+    Commands made from similar functions share read-only Args, Options
+    and parsed docstrings, which are kept for as long as the process
+    runs. A process that keeps making and dropping apps, like a
+    benchmark, can call this to let go of them.
+
+    """
+
+    _shared.clear()
+
+def _index_opts(opts):
+    """Return a dict mapping names and short names to Options in `opts`.
+
+    The result is meant to be built once, when a set of options is
+    defined, and treated as read-only after that. Looking an option up
+    in it costs the same no matter how many options there are.
+
+    opts -- an iterable of Options.
+
+    """
+
+    index = {}
+    for opt in opts:
+        index[opt.name] = opt
+        if opt.short_name is not None:
+            index[opt.short_name] = opt
+
+    return index
+
+class Arg(object):
+    """An argument for a command-line app."""
+
+    __slots__ = ('name', 'default', 'type_converter', '_summary', '_doc')
+
+    def __init__(self, name, summary, default=None, type_converter=None,
+                 doc=None):
+        """Make a new Arg.
+
+        doc -- optional _DocInfo to look up the summary in when it's
+               first needed, if `summary` is None.
+
+        """
+
+        self.name = _intern(name)
+        self.summary = summary
+        self.default = default
+        self.type_converter = type_converter
+        self._doc = doc if summary is None else None
+
+    @property
+    def summary(self):
+        """This Arg's summary, or None if it has none."""
+
+        if self._doc is not None:
+            self._summary = self._doc.summaries.get(self.name.replace('-',
+                                                                      '_'))
+            self._doc = None
+
+        return self._summary
+
+    @summary.setter
+    def summary(self, value):
+        global _doc_changes
+
+        self._summary = value
+        self._doc = None
+        _doc_changes += 1
+
+    def format_name(self):
+        """Return a string representing this argument's name."""
+
+        return self.name
+
+    def convert_type(self, val):
+        """Return `val` after converting it to this Arg's type.
+
+        Raises InvalidArg if the type converter raises a ValueError.
+
+        """
+
+        if val is not None and self.type_converter is not None:
+            try:
+                val = self.type_converter(val)
+            except ValueError:
+                raise self._invalid(val)
+
+        return val
+
+    def convert_each(self, values, position=1):
+        """Yield each of `values` after converting it to this Arg's type.
+
+        This is for the values of *varargs. It converts them one at a
+        time, as they are asked for, so `values` may be a lazy iterator.
+
+        Raises InvalidArg, with its position set, if a value can't be
+        converted.
+
+        position -- position of the first of `values` among the
+                    command's args, counting from 1.
+
+        """
+
+        for position, val in enumerate(values, position):
+            try:
+                yield self.convert_type(val)
+            except InvalidArg as exc:
+                exc.position = position
+                raise
+
+    def convert_all(self, values, position=None):
+        """Return `values` converted at once by a bulk type converter.
+
+        This is for converters with a convert_all() method, like the
+        ones ndarray() returns. See _is_bulk().
+
+        Raises InvalidArg if a value can't be converted.
+
+        position -- position of the first of `values` among the
+                    command's args, counting from 1, to report for an
+                    invalid value.
+
+        """
+
+        values = list(values)
+        try:
+            return self.type_converter.convert_all(values)
+        except ValueError as exc:
+            index = getattr(exc, 'index', None)
+            if index is None:
+                raise self._invalid(' '.join(values))
+
+            invalid = self._invalid(values[index])
+            if position is not None:
+                invalid.position = position + index
+            raise invalid
+
+    def _invalid(self, val):
+        """Return an exception saying `val` is not valid for this Arg."""
+
+        return InvalidArg(self.name, val)
+
+    def format_summary(self, width=70):
+        """Return a formatted summary of `self`.
+
+        Return `self.format_name()` if no summary is available.
+
+        width -- Optional max width of a line in result. Defaults to 70.
+
+        """
+
+        import textwrap
+
+        summary = ''
+        name = self.format_name()
+
+        if self.summary is None:
+            return '  ' + name
+
+        for line in self.summary.splitlines():
+            if line is not '':
+                summary += textwrap.fill(line, width,
+                                         initial_indent=' ' * 6,
+                                         subsequent_indent=' ' * 6)
+            else:
+                summary += os.linesep * 2
+
+        return '  %s%s%s' % (name, os.linesep, summary)
+
+class Option(Arg):
+    """An option for a command-line app.
+
+    self.is_repeatable is True if the option can be given more than
+    once. Options whose default is a list or an array.array are.
+
+    """
+
+    __slots__ = ('short_name', 'is_repeatable')
+
+    def __init__(self, name, summary, default, short_name=None,
+                 type_converter=None, doc=None):
+        """Make a new Option.
+
+        short_name -- Optional single letter to use as a short name.
+            Defaults to the first letter of `name`. Pass '' for an
+            Option with no short name.
+        doc -- optional _DocInfo to look up the summary in when it's
+               first needed, if `summary` is None.
+
+        """
+
+        self.name = _intern(name)
+        self.default = default
+        self.summary = summary
+        self._doc = doc if summary is None else None
+        if short_name is None:
+            short_name = name[0]
+        self.short_name = _intern(short_name) or None
+        self.type_converter = type_converter
+        self.is_repeatable = isinstance(default, list) or _is_array(default)
+
+    def format_name(self):
+        """Return this Option's name(s) as a string."""
+
+        result = ''
+        if self.short_name is not None:
+            result += '-%s, ' % self.short_name
+
+        result += '--%s' % self.name
+
+        return result
+
+    def _invalid(self, val):
+        """Return an exception saying `val` is not valid for this Option."""
+
+        return InvalidOption(self.name, val)
+
+    @property
+    def is_flag(self):
+        """Return True if this Option is a flag. Return False otherwise."""
+
+        return type(self.default) is bool
+
+    def convert_values(self, vals):
+        """Return list `vals` of a repeatable Option, converted to its type.
+
+        The result is a list if self.default is a list. If it's an
+        array.array, the result is an array with the same typecode, so
+        numbers aren't each stored as an object. Values are then
+        converted by self.type_converter if it's set, or by a converter
+        suited to the typecode otherwise. Bulk converters, like
+        ndarray(), return whatever they make, whatever the default.
+
+        Raises InvalidOption if a value can't be converted.
+
+        """
+
+        if _is_bulk(self.type_converter):
+            return self.convert_all(vals)
+        elif not _is_array(self.default):
+            return [self.convert_type(val) for val in vals]
+
+        import array
+
+        typecode = self.default.typecode
+        result = array.array(typecode)
+        append = result.append
+        converter = self.type_converter or _ARRAY_CONVERTERS.get(typecode, int)
+        for val in vals:
+            try:
+                append(converter(val))
+            except (ValueError, OverflowError):
+                raise self._invalid(val)
+
+        return result
+
+# Converters for the values of repeatable options whose default is an
+# array.array with these typecodes. Other typecodes take ints.
+_ARRAY_CONVERTERS = {'c': str, 'u': unicode, 'f': float, 'd': float}
+
+def _is_bulk(converter):
+    """Return True if `converter` converts many values at once.
+
+    Bulk converters have a convert_all() method, which takes a list of
+    strings. See ndarray().
+
+    """
+
+    return hasattr(converter, 'convert_all')
+
+def _is_array(val):
+    """Return True if `val` is an array.array."""
+
+    # If array hasn't been imported, nothing can be an array.
+    array = sys.modules.get('array')
+
+    return array is not None and isinstance(val, array.array)
+
+def _set_private_attr(self, name, value):
+    """__setattr__ for shared objects, which only lets them cache things."""
+
+    if not name.startswith('_'):
+        raise AttributeError("'%s' is shared between commands, so it can't "
+                             "be changed." % self.name)
+
+    object.__setattr__(self, name, value)
+
+class _SharedArg(Arg):
+    """An Arg shared between Commands, which is read-only. See _share()."""
+
+    __slots__ = ()
+
+    __setattr__ = _set_private_attr
+
+class _SharedOption(Option):
+    """An Option shared between Commands, which is read-only. See _share()."""
+
+    __slots__ = ()
+
+    __setattr__ = _set_private_attr
+
+class _SharedDict(dict):
+    """A read-only dict, shared between Commands. See _share()."""
+
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("This dict is shared between commands, so it can't "
+                        "be changed.")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = \
+        update = _read_only
+
+def _freeze(spec):
+    """Make Arg or Option `spec` read-only for sharing, and return it."""
+
+    spec.__class__ = _SharedOption if isinstance(spec, Option) else _SharedArg
+
+    return spec
+
+class MetadataCache(object):
+    """An on-disk cache of what Command.from_func() reads from docstrings.
+
+    Parsing every command's docstring on every run adds up for apps
+    with many commands. With a cache, a function's usage message and
+    param summaries are parsed once, then read back on later runs.
+
+    Entries are grouped by the source file of the module a function is
+    defined in, and a group is thrown out as soon as that file's mtime
+    or size changes. The whole cache is thrown out if cmdline.py
+    itself changes, as it may parse docstrings differently. Functions
+    that don't come from a file on disk are never cached.
+
+    The cache is written by save(), which App.run() calls. Deleting the
+    file is always safe. So is using a cache that can't be written -
+    it just never gets warm.
+
+    """
+
+    # Bump this whenever what's stored in the cache changes shape.
+    _FORMAT = 1
+
+    def __init__(self, path):
+        """Make a new MetadataCache.
+
+        path -- path to the cache file. It need not exist yet.
+
+        """
+
+        self.path = path
+        self.dirty = False
+
+        # Maps source file name => (mtime, size, entries), where entries
+        # maps a function's key to (usage_msg, summaries). Loaded on
+        # first use.
+        self._files = None
+
+        # Source files whose stored mtime and size have been checked
+        # against the file system during this run.
+        self._checked = set()
+
+    @staticmethod
+    def _stat(filename):
+        """Return (mtime, size) for `filename`, or None if it is missing."""
+
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+
+        return st.st_mtime, st.st_size
+
+    @staticmethod
+    def _source_file(module):
+        """Return the name of the file `module` was loaded from, or None."""
+
+        filename = getattr(module, '__file__', None)
+        if filename is None:
+            return None
+
+        if filename.endswith(('.pyc', '.pyo')):
+            filename = filename[:-1]
+
+        return os.path.abspath(filename)
+
+    def _header(self):
+        """Return the header identifying the cache format in use."""
+
+        own_file = self._source_file(sys.modules[__name__])
+        return (self._FORMAT, sys.version_info[:2], self._stat(own_file))
+
+    def _load(self):
+        """Read the cache file into self._files, if it hasn't been."""
+
+        if self._files is not None:
+            return
+
+        self._files = {}
+        try:
+            with open(self.path, 'rb') as cache_file:
+                header, files = marshal.load(cache_file)
+        except (IOError, EOFError, ValueError, TypeError):
+            # Missing or corrupt - either way, start from scratch.
+            return
+
+        if header == self._header():
+            self._files = files
+
+    def _entries(self, func):
+        """Return (entries, key) for `func`, or (None, None) if uncacheable.
+
+        `entries` is the dict of cached data for the file `func` was
+        defined in, emptied first if the file has changed since it was
+        cached.
+
+        """
+
+        code = getattr(getattr(func, 'im_func', func), 'func_code', None)
+        module = sys.modules.get(getattr(func, '__module__', None))
+        filename = self._source_file(module)
+        if code is None or filename is None:
+            return None, None
+
+        self._load()
+        if filename not in self._checked:
+            self._checked.add(filename)
+            stat = self._stat(filename)
+            cached = self._files.get(filename)
+            if stat is None:
+                if self._files.pop(filename, None) is not None:
+                    self.dirty = True
+            elif cached is None or cached[:2] != stat:
+                self._files[filename] = stat + ({},)
+                self.dirty = self.dirty or cached is not None
+
+        entries = self._files.get(filename)
+        if entries is None:
+            return None, None
+
+        # The line number tells apart functions that share a name, like
+        # methods of different classes.
+        key = '%s:%d' % (func.__name__, code.co_firstlineno)
+
+        return entries[2], key
+
+    def get(self, func):
+        """Return cached (usage_msg, summaries) for `func`, or None."""
+
+        entries, key = self._entries(func)
+        if entries is None:
+            return None
+
+        return entries.get(key)
+
+    def set(self, func, usage_msg, summaries):
+        """Cache `usage_msg` and `summaries` for `func`."""
+
+        entries, key = self._entries(func)
+        if entries is not None:
+            entries[key] = (usage_msg, summaries)
+            self.dirty = True
+
+    def save(self):
+        """Write the cache to disk, if anything in it has changed.
+
+        The file is replaced atomically, so concurrent runs never see a
+        partial cache. Failing to write it is not an error.
+
+        """
+
+        if not self.dirty:
+            return
+
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as cache_file:
+                marshal.dump((self._header(), self._files), cache_file)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        else:
+            self.dirty = False
+
+    def clear(self):
+        """Empty the cache and delete its file."""
+
+        self._files = {}
+        self._checked = set()
+        self.dirty = False
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+class Command(object):
+    """A sub-command in a command-line app.
+
+    These are best created by decorating functions with App.command() or
+    App.main().
+
+    Using this class directly would work, but it wouldn't be as pretty.
+
+    """
+
+    __slots__ = ('func', 'name', 'args', 'opt_args', 'opts', 'opt_index',
+                 'varargs', 'lazy_varargs', '_usage_msg', '_summary', '_doc',
+                 '_param_order')
+
+    # GRIPE You could argue that __init__ should actually just be
+    # from_func. I'm not sure if you'd be right or not.
+    def __init__(self, func, args, opt_args, opts, arg_types=None,
+                 usage_msg=None, name=None, doc=None, opt_index=None,
+                 varargs=None, lazy_varargs=False):
+        """Make a new Command.
+
+        func -- callable that does the command's work.
+        args -- list of required positional args for this command.
+        opt_args -- list of optional positional args for this command.
+        opts -- dict of options for this command. Options map a name to a
+            (required) passed value (with an optional short name).
+        usage_msg -- Optional string explaining the command. Defaults to
+            None.
+        name -- Optional command name. If None, self.name is set by
+            replacing '_' with '-' in func.__name__.
+        doc -- Optional _DocInfo to get the usage message from when it's
+            first needed, if `usage_msg` is None.
+        opt_index -- Optional index of `opts`, as made by _index_opts().
+            Made from `opts` if None.
+        varargs -- Optional Arg that takes any args after `args` and
+            `opt_args`. If None, no more args are allowed.
+        lazy_varargs -- If True, the values of `varargs` are passed to
+            `func` as an iterator, by keyword, rather than as more
+            positional args. See from_func(). Defaults to False.
+
+        """
+
+        self.func = func
+        self.name = _intern(func.__name__.replace('_', '-') if name is None
+                            else name)
+        self.args = args
+        self.opt_args = opt_args
+        self.opts = opts
+        self.varargs = varargs
+        self.lazy_varargs = lazy_varargs
+        self.usage_msg = usage_msg
+        self._doc = doc if usage_msg is None else None
+
+        # Worked out from func's signature when first run. See run().
+        self._param_order = _UNPARSED
+
+        short_names = {}
+        for key, value in self.opts.items():
+            if value.short_name is None:
+                continue
+
+            if value.short_name in short_names:
+                raise InvalidShortName(self.name, value.short_name,
+                                       short_names[value.short_name],
+                                       value.name)
+
+            short_names[value.short_name] = key
+
+        # Built once, here, so parsing argv never has to scan self.opts.
+        if opt_index is None:
+            opt_index = _index_opts(self.opts.values())
+        self.opt_index = opt_index
+
+    @property
+    def usage_msg(self):
+        """String explaining this Command, or None."""
+
+        if self._doc is not None:
+            self._usage_msg = self._doc.usage_msg
+            self._doc = None
+
+        return self._usage_msg
+
+    @usage_msg.setter
+    def usage_msg(self, value):
+        global _doc_changes
+
+        self._usage_msg = value
+        self._doc = None
+        self._summary = _UNPARSED
+        _doc_changes += 1
+
+    @property
+    def summary(self):
+        """The first sentence of self.usage_msg, or None."""
+
+        if self._summary is _UNPARSED:
+            summary = self.usage_msg
+            if summary is not None:
+                end_idx = summary.find('.')
+                if end_idx > 0:
+                    summary = summary[0:end_idx + 1]
+            self._summary = summary
+
+        return self._summary
+
+    @summary.setter
+    def summary(self, value):
+        global _doc_changes
+
+        self._summary = value
+        _doc_changes += 1
+
+    @property
+    def min_argc(self):
+        """Minimum number of args to this Command."""
+
+        return len(self.args)
+
+    @property
+    def max_argc(self):
+        """Maximum number of args to this Command, not counting varargs."""
+
+        return len(self.args) + len(self.opt_args)
+
+    def run(self, args, kwargs):
+        """Run this command using args and kwargs.
+
+        Values from converters that hold files open, like MappedFile, are
+        closed after the command returns. If it returns an iterator, such
+        as a generator, they're closed once that's used up or closed.
+
+        """
+
+        order = self._param_order
+        if order is _UNPARSED:
+            order = self._param_order = self._find_param_order()
+
+        if order is not None and len(args) > self.max_argc:
+            # Python fills every param before *varargs by position, so
+            # options have to be passed that way too.
+            kwargs = dict(kwargs)
+            args = ([args[src] if type(src) is int else
+                     kwargs.pop(src, self.opts[src].default)
+                     for src in order] +
+                    list(args[self.max_argc:]))
+        elif order is not None:
+            # Some options come before optional args, so pass args by name.
+            kwargs = dict(kwargs)
+            for spec, val in zip(self.args + self.opt_args, args):
+                kwargs[spec.name.replace('-', '_')] = val
+            args = ()
+
+        inputs = [val for val in itertools.chain(args, kwargs.itervalues())
+                  if isinstance(val, _Input)]
+        if not inputs:
+            return self.func(*args, **kwargs)
+
+        try:
+            result = self.func(*args, **kwargs)
+        except:
+            _close_all(inputs)
+            raise
+
+        if hasattr(result, '__iter__') and iter(result) is result:
+            # Whatever the iterator yields may still need the inputs.
+            return _close_after(result, inputs)
+
+        _close_all(inputs)
+        return result
+
+    def _find_param_order(self):
+        """Return where self.func's params get their values from, or None.
+
+        Each item stands for one of self.func's params, in the order it
+        takes them, up to any *varargs. An arg's item is its position in
+        self.args + self.opt_args. Any other param's item is its name.
+
+        Returns None if self.func takes its args first, in the order of
+        self.args + self.opt_args, and has no varargs, since then args
+        can be passed to it as they are.
+
+        """
+
+        names = _get_argspec(self.func)[0]
+        if isinstance(self.func, types.MethodType):
+            names = names[1:]
+
+        positions = {}
+        for pos, spec in enumerate(self.args + self.opt_args):
+            positions[spec.name.replace('-', '_')] = pos
+
+        order = [positions.get(name, name) for name in names]
+        if self.varargs is None and order[:self.max_argc] == range(
+                self.max_argc):
+            return None
+
+        return order
+
+    @classmethod
+    def from_func(cls, func, short_names=None, opt_args=None, arg_types=None,
+                  usage_msg=None, name=None, cache=None, lazy_varargs=None):
+        """Get an instance of Command by introspecting func.
+
+        func -- a callable object.
+        short_names -- a dict mapping long option names to single letters.
+                       Map a name to None to give that option no short
+                       name.
+        opt_args -- a list of func's optional params that should be
+                    treated as optional command-line args instead of
+                    options.
+        arg_types -- optional dict mapping arg names to callables that
+                     take a string as input and either return an object
+                     of the desired type or raise a ValueError.
+        usage_msg -- an optional string explaining the command. Defaults
+                     to a processed version of func's docstring.
+        name -- an optional name for the command. Defaults to a
+                transformed version of `func`'s name.
+        cache -- an optional MetadataCache. If given, what func's
+                 docstring says is looked up in it before parsing the
+                 docstring, and stored in it after.
+        lazy_varargs -- optional name of one of func's params to pass
+                        all args after the others to, as an iterator
+                        that converts each one as it's asked for. Its
+                        values are read from argv while the command
+                        runs, so every option must come before them.
+
+        If func takes *varargs, they take any args after the others.
+
+        func's docstring is not parsed here, only when a usage message
+        or summary is first needed.
+
+        """
+
+        if opt_args is None:
+            # GRIPE It might be better to go through and make default
+            # opt_args an empty list everywhere.
+            opt_args = []
+
+        if arg_types is None:
+            arg_types = {}
+
+        # The docstring is only parsed if something asks for a summary or
+        # the usage message, which running the command never does. Functions
+        # with the same docstring share what's parsed from it.
+        doc = _share(('doc', func.__doc__, cache),
+                     lambda: _DocInfo(func, cache=cache))
+
+        # Inspect func for hard data.
+        func_args, varargs, varkw, defaults = _get_argspec(func)
+        if isinstance(func, types.MethodType):
+            # Do not include the self/cls parameter.
+            func_args = func_args[1:]
+        num_defaults = 0 if defaults is None else len(defaults)
+        num_func_args = 0 if func_args is None else len(func_args) - num_defaults
+        func_name = func.__name__
+
+        if lazy_varargs is not None:
+            # The iterator is passed by keyword, so the param must come
+            # after every param that's passed by position.
+            pos = (func_args.index(lazy_varargs)
+                   if lazy_varargs in func_args else -1)
+            positional = func_args[:num_func_args] + [
+                arg for arg in opt_args if arg in func_args]
+            if (pos < 0 or varargs is not None or
+                any(func_args.index(arg) > pos for arg in positional)):
+                raise ValueError("'%s' can't take lazy varargs as '%s'." %
+                                 (func_name, lazy_varargs))
+
+            varargs = lazy_varargs
+            if pos < num_func_args:
+                num_func_args -= 1
+            else:
+                defaults = list(defaults)
+                del defaults[pos - num_func_args]
+            del func_args[pos]
+
+        if varargs is not None:
+            type_converter = arg_types.get(varargs)
+            if lazy_varargs is None and _is_bulk(type_converter):
+                raise ValueError("'%s' can only get '%s' as an array if it "
+                                 "takes them as lazy varargs." %
+                                 (func_name, varargs))
+
+            varargs_name = varargs.replace('_', '-')
+            varargs = _share(('varargs', varargs_name, type_converter, doc),
+                             lambda: _freeze(Arg(varargs_name, None,
+                                                 type_converter=type_converter,
+                                                 doc=doc)))
+
+        # Build required arg dict.
+        arg_list = func_args[:num_func_args]
+        args = []
+        for arg in arg_list:
+            type_converter = arg_types.get(arg)
+            arg_name = arg.replace('_', '-')
+
+            args.append(_share(('arg', arg_name, type_converter, doc),
+                               lambda: _freeze(Arg(
+                                   arg_name, None,
+                                   type_converter=type_converter, doc=doc))))
+
+        # Build optional arg list and options dict.
+        opts = {}
+        for i, arg in enumerate(func_args[num_func_args:]):
+            short_name = None
+            if short_names is not None:
+                tmp = short_names.get(arg)
+                if tmp is not None and len(tmp) == 1:
+                    short_name = tmp
+                elif tmp is None and arg in short_names:
+                    short_name = ''
+
+            # The default's type is part of the key, as 1 == True.
+            default = defaults[i]
+            key = (arg, type(default), default, arg_types.get(arg), doc)
+
+            if arg in opt_args:
+                pos = opt_args.index(arg)
+                type_converter = arg_types.get(arg)
+                arg_name = arg.replace('_', '-')
+                opt_args[pos] = _share(('opt_arg',) + key,
+                                       lambda: _freeze(Arg(
+                                           arg_name, None, default,
+                                           type_converter, doc)))
+
+                continue
+
+            type_converter = arg_types.get(arg)
+            opt_name = arg.replace('_', '-')
+            opts[arg] = _share(('opt', short_name) + key,
+                               lambda: _freeze(Option(
+                                   opt_name, None, default, short_name,
+                                   type_converter, doc)))
+
+        # Options are shared, so commands with the same ones can share a dict
+        # of them, and its index, too.
+        opts, opt_index = _share(
+            ('opts',) + tuple(sorted((key, id(opt))
+                                     for key, opt in opts.items())),
+            lambda: (_SharedDict(opts),
+                     _SharedDict(_index_opts(opts.values()))))
+
+        return cls(func, args, opt_args, opts, arg_types, usage_msg, name,
+                   doc, opt_index, varargs, lazy_varargs is not None)
+
+def _close_all(inputs):
+    """Close each of `inputs`, which are _Inputs."""
+
+    for val in inputs:
+        val.close()
+
+def _close_after(results, inputs):
+    """Yield what iterator `results` does, then close list of _Inputs `inputs`.
+
+    They're also closed if this generator is closed before the end.
+
+    """
+
+    try:
+        for result in results:
+            yield result
+    finally:
+        _close_all(inputs)
+
+def _import_object(import_path):
+    """Return the object `import_path` names, importing its module.
+
+    import_path -- string of the form 'module:name'. The name may be an
+        attribute of an attribute of the module, as in 'module:Class.method'.
+
+    """
+
+    module_name, sep, attr_path = import_path.partition(':')
+    __import__(module_name)
+    obj = sys.modules[module_name]
+    for attr in attr_path.split('.'):
+        obj = getattr(obj, attr)
+
+    return obj
+
+def _get_import_path(obj, main_module):
+    """Return an import path for function or class `obj`.
+
+    The result is a string that _import_object() turns back into `obj`.
+    Raises ValueError if `obj` isn't a module-level name, like a lambda.
+
+    main_module -- name to import things defined in __main__ by.
+
+    """
+
+    module_name = getattr(obj, '__module__', None)
+    name = getattr(obj, '__name__', None)
+    module = sys.modules.get(module_name)
+    if module is None or name is None or getattr(module, name, None) is not obj:
+        raise ValueError('%r cannot be imported by name.' % (obj,))
+
+    if module_name == '__main__':
+        module_name = main_module
+
+    return '%s:%s' % (module_name, name)
+
+class LazyCommand(object):
+    """A stand-in for a Command whose function has not been imported.
+
+    These are made by App.lazy_command(). They know enough to list a
+    command without importing anything, and load() makes the real
+    Command when it's needed.
+
+    """
+
+    def __init__(self, import_path, name=None, summary=None,
+                 short_names=None, opt_args=None, arg_types=None,
+                 usage_msg=None, lazy_varargs=None):
+        """Make a new LazyCommand.
+
+        See App.lazy_command() for what the args mean.
+
+        """
+
+        module_name, sep, attr_path = import_path.partition(':')
+        if not module_name or not attr_path:
+            raise ValueError("Import path '%s' is not of the form "
+                             "'module:function'." % import_path)
+
+        if name is None:
+            name = attr_path.split('.')[-1].replace('_', '-')
+
+        self.import_path = import_path
+        self.name = name
+        self.summary = summary
+        self.short_names = short_names
+        self.opt_args = opt_args
+        self.arg_types = arg_types
+        self.usage_msg = usage_msg
+        self.lazy_varargs = lazy_varargs
+
+    def load(self, app):
+        """Import this command's function and return a Command for it.
+
+        app -- the App this command belongs to, whose defaults are used
+               in making the Command.
+
+        """
+
+        func = _import_object(self.import_path)
+
+        # Command.from_func() modifies opt_args in place, so give it a copy.
+        opt_args = None if self.opt_args is None else list(self.opt_args)
+
+        cmd = app._make_cmd(func, self.short_names, opt_args, self.arg_types,
+                            self.usage_msg, self.name, self.lazy_varargs)
+
+        # Keep listing the command the same way it was before it loaded.
+        if self.summary is not None and cmd.summary is None:
+            cmd.summary = self.summary
+
+        return cmd
+
+# Number of items of a command's results to join and write at once.
+_RESULT_CHUNK = 1024
+
+class _TextEncoder(object):
+    """Turns a command's results into lines of text, for --format=text.
+
+    Encoders are made once per command run, and their encode() method
+    is passed a list of results at a time, returning them as one
+    string. Strings are written as they are, unicode is encoded and
+    anything else is passed to str().
+
+    """
+
+    def __init__(self, encoding):
+        """Make a new encoder.
+
+        encoding -- the encoding to write unicode in.
+
+        """
+
+        self.encoding = encoding
+
+    def encode(self, rows):
+        """Return list `rows` as one string, ending with a newline."""
+
+        try:
+            text = '\n'.join(rows)
+        except TypeError:
+            text = '\n'.join([row if isinstance(row, basestring) else str(row)
+                               for row in rows])
+        if type(text) is unicode:
+            text = text.encode(self.encoding)
+
+        return text + '\n'
+
+class _JSONLinesEncoder(object):
+    """Turns results into one JSON value per line, for --format=jsonl."""
+
+    def __init__(self, encoding):
+        import json
+        import json.encoder
+
+        encoder = json.JSONEncoder(separators=(',', ':'))
+        self._encode = encoder.encode
+
+        # JSONEncoder.encode() makes a new C encoder for every call, which
+        # costs more than encoding a small row. Make one to reuse instead,
+        # if json's C speedups are there.
+        self._c_encode = None
+        if json.encoder.c_make_encoder is not None:
+            self._c_encode = json.encoder.c_make_encoder(
+                {}, encoder.default, json.encoder.encode_basestring_ascii,
+                None, encoder.key_separator, encoder.item_separator,
+                encoder.sort_keys, encoder.skipkeys, encoder.allow_nan)
+
+    def encode(self, rows):
+        """Return list `rows` as one string, ending with a newline."""
+
+        if self._c_encode is None:
+            return '\n'.join(map(self._encode, rows)) + '\n'
+
+        join = ''.join
+        c_encode = self._c_encode
+
+        return '\n'.join([join(c_encode(row, 0)) for row in rows]) + '\n'
+
+class _CSVEncoder(object):
+    """Turns results into rows of comma-separated values, for --format=csv.
+
+    Results may be tuples or lists of values, or dicts. If the first
+    result is a dict, its keys become a header row and the columns of
+    every row. Keys are sorted for plain dicts, or kept in order for
+    ones like OrderedDict. Anything else is written as a row of one
+    value.
+
+    """
+
+    delimiter = ','
+
+    def __init__(self, encoding):
+        import csv
+
+        self.encoding = encoding
+        self._buffer = cStringIO.StringIO()
+        self._writer = csv.writer(self._buffer, delimiter=self.delimiter,
+                                  lineterminator='\n')
+
+        # Turns a result into a sequence of values, or is None if results
+        # already are. Chosen when the first result is seen. For dicts,
+        # _fill_row() does the same, but leaves missing keys' values
+        # blank, and is only used when a chunk has rows with keys missing.
+        self._to_row = _UNPARSED
+        self._fill_row = None
+
+    def _choose_row_maker(self, first):
+        """Set self._to_row for results like `first`."""
+
+        if isinstance(first, dict):
+            import operator
+
+            fields = sorted(first) if type(first) is dict else list(first)
+            self._writer.writerow(self._encode_cells(fields))
+            if len(fields) > 1:
+                self._to_row = operator.itemgetter(*fields)
+            else:
+                self._to_row = lambda row: (row[fields[0]],)
+            self._fill_row = lambda row: [row.get(field, '')
+                                          for field in fields]
+        elif isinstance(first, (tuple, list)):
+            self._to_row = None
+        else:
+            self._to_row = lambda row: (row,)
+
+    def _encode_cells(self, row):
+        """Return `row` with any unicode values encoded."""
+
+        return [val.encode(self.encoding) if type(val) is unicode else val
+                for val in row]
+
+    def encode(self, rows):
+        """Return list `rows` as one string of CSV lines."""
+
+        if self._to_row is _UNPARSED:
+            self._choose_row_maker(rows[0])
+
+        if self._to_row is not None:
+            try:
+                rows = map(self._to_row, rows)
+            except KeyError:
+                rows = map(self._fill_row, rows)
+
+        start = self._buffer.tell()
+        try:
+            self._writer.writerows(rows)
+        except UnicodeEncodeError:
+            # csv can't write unicode, so start the chunk over, encoded.
+            self._buffer.seek(start)
+            self._buffer.truncate()
+            self._writer.writerows(map(self._encode_cells, rows))
+
+        text = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+
+        return text
+
+class _TSVEncoder(_CSVEncoder):
+    """Turns results into rows of tab-separated values, for --format=tsv."""
+
+    delimiter = '\t'
+
+# Encoders for the output formats --format can choose.
+_OUTPUT_FORMATS = {
+    'text': _TextEncoder,
+    'jsonl': _JSONLinesEncoder,
+    'csv': _CSVEncoder,
+    'tsv': _TSVEncoder,
+}
+
+# The App whose run_batch() started the current process pool, if any.
+_pool_app = None
+
+# Seconds to wait for a batch line run by a process pool. It only needs to
+# be set because waiting without a timeout can't be interrupted.
+_POOL_TIMEOUT = 365 * 24 * 60 * 60
+
+def _init_pool_worker():
+    """Set up a worker process for App._run_batch_pool()."""
+
+    # Leave handling Ctrl-C to the parent process.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # Anything profiled here would be thrown away with the process.
+    _pool_app._profiler = None
+
+class _OutputBuffer(object):
+    """A file object that keeps what's written to it, for getvalue().
+
+    It stands in for stdout or stderr while a batch line runs. Unicode
+    is encoded with the encoding of the file it stands in for, as
+    writing to that would, since cStringIO only takes ASCII unicode.
+
+    """
+
+    def __init__(self, stream):
+        self.encoding = getattr(stream, 'encoding', None)
+        self._buffer = cStringIO.StringIO()
+
+        # Needed by print statements.
+        self.softspace = 0
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode(self.encoding or sys.getdefaultencoding())
+
+        self._buffer.write(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+    def getvalue(self):
+        return self._buffer.getvalue()
+
+def _run_pool_line(numbered_line):
+    """Run a batch line in a worker process for App._run_batch_pool().
+
+    Returns (line number, exit code, stdout, stderr).
+
+    """
+
+    line_num, line = numbered_line
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = _OutputBuffer(stdout), _OutputBuffer(stderr)
+    try:
+        exit_code = _pool_app._run_batch_line(line_num, line)
+        return line_num, exit_code, sys.stdout.getvalue(), sys.stderr.getvalue()
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+
+class _ThreadOutput(object):
+    """A file object that can send each thread's writes to its own buffer.
+
+    Threads that have called capture() write to their buffer until they
+    call release(). Other threads write to the wrapped file object.
+
+    """
+
+    def __init__(self, stream):
+        import threading
+
+        self._stream = stream
+        self._local = threading.local()
+
+    def _target(self):
+        """Return the file object the current thread should write to."""
+
+        return getattr(self._local, 'buffer', None) or self._stream
+
+    def capture(self):
+        """Start sending the current thread's writes to a buffer."""
+
+        self._local.buffer = _OutputBuffer(self._stream)
+
+    def release(self):
+        """Stop buffering the current thread's writes and return them."""
+
+        output = self._local.buffer.getvalue()
+        del self._local.buffer
+
+        return output
+
+    def write(self, data):
+        self._target().write(data)
+
+    def writelines(self, lines):
+        self._target().writelines(lines)
+
+    def flush(self):
+        self._target().flush()
+
+    # Print statements keep track of this per file object, and it should be
+    # per thread.
+    softspace = property(lambda self: getattr(self._local, 'softspace', 0),
+                         lambda self, value: setattr(self._local,
+                                                     'softspace', value))
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+# Frames sent between call_server() and App.serve() start with a one-byte
+# kind and a four-byte payload length.
+_FRAME_FORMAT = '>cI'
+_FRAME_HEADER_SIZE = 5
+
+def _send_frame(sock, kind, payload=''):
+    """Send a frame of `kind` with `payload` over `sock`."""
+
+    import struct
+
+    sock.sendall(struct.pack(_FRAME_FORMAT, kind, len(payload)) + payload)
+
+def _recv_exactly(sock, size):
+    """Return exactly `size` bytes from `sock`, or None if it closes first."""
+
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(size)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+
+    return ''.join(chunks)
+
+def _recv_frame(sock):
+    """Return (kind, payload) for the next frame from `sock`.
+
+    Returns (None, None) if the connection closes.
+
+    """
+
+    import struct
+
+    header = _recv_exactly(sock, _FRAME_HEADER_SIZE)
+    if header is None:
+        return None, None
+
+    kind, size = struct.unpack(_FRAME_FORMAT, header)
+    payload = _recv_exactly(sock, size)
+    if payload is None:
+        return None, None
+
+    return kind, payload
+
+class _RemoteInput(object):
+    """A read-only file object that reads a call_server() client's stdin.
+
+    Input is asked for only as it's read, so commands that never read
+    stdin never wait on it.
+
+    """
+
+    # Most bytes asked for at a time.
+    _CHUNK_SIZE = 65536
+
+    def __init__(self, sock):
+        self._sock = sock
+        self._buffer = ''
+        self._eof = False
+        self.closed = False
+
+    def _fill(self):
+        """Add more input to self._buffer. Return False at end of input."""
+
+        import struct
+
+        if self._eof:
+            return False
+
+        _send_frame(self._sock, 'N', struct.pack('>I', self._CHUNK_SIZE))
+        kind, data = _recv_frame(self._sock)
+        if not data:
+            self._eof = True
+            return False
+
+        self._buffer += data
+
+        return True
+
+    def read(self, size=-1):
+        while (size < 0 or len(self._buffer) < size) and self._fill():
+            pass
+
+        if size < 0:
+            size = len(self._buffer)
+
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+
+        return data
+
+    def readline(self, size=-1):
+        while '\n' not in self._buffer and self._fill():
+            pass
+
+        end = self._buffer.find('\n') + 1 or len(self._buffer)
+        if size >= 0:
+            end = min(end, size)
+
+        line, self._buffer = self._buffer[:end], self._buffer[end:]
+
+        return line
+
+    def readlines(self, sizehint=-1):
+        return list(self)
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def isatty(self):
+        return False
+
+    def close(self):
+        self.closed = True
+
+class _RemoteOutput(object):
+    """A write-only file object that writes to a call_server() client.
+
+    Output is buffered, and sent as a frame of `kind` when the buffer
+    fills or is flushed.
+
+    """
+
+    # Most bytes buffered before they are sent.
+    _BUFFER_SIZE = 65536
+
+    def __init__(self, sock, kind):
+        self._sock = sock
+        self._kind = kind
+        self._buffer = []
+        self._size = 0
+        self.closed = False
+
+        # Needed by print statements.
+        self.softspace = 0
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+
+        self._buffer.append(data)
+        self._size += len(data)
+        if self._size >= self._BUFFER_SIZE:
+            self.flush()
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        if self._size > 0:
+            _send_frame(self._sock, self._kind, ''.join(self._buffer))
+            self._buffer = []
+            self._size = 0
+
+    def isatty(self):
+        return False
+
+    def close(self):
+        self.flush()
+        self.closed = True
+
+# Written into modules generated by App.compile(), after the tables that
+# describe the App. It must not need cmdline.py, or anything else that isn't
+# always imported.
+_COMPILED_RUNTIME = r'''
+class _UsageError(Exception):
+    """Indicates invalid input. The message says what was wrong."""
+
+    def __init__(self, msg, show_cmds=False):
+        Exception.__init__(self, msg)
+        self.show_cmds = show_cmds
+
+def _load(import_path):
+    """Return the object named by 'module:attr.path' `import_path`."""
+
+    module_name, sep, attr_path = import_path.partition(':')
+    __import__(module_name)
+    obj = sys.modules[module_name]
+    for attr in attr_path.split('.'):
+        obj = getattr(obj, attr)
+
+    return obj
+
+def _convert(name, converter, val, position=None):
+    """Return `val` converted by the converter at import path `converter`.
+
+    position -- position of a value of *varargs, to report if it's invalid.
+
+    """
+
+    if val is None or converter is None:
+        return val
+
+    try:
+        return _load(converter)(val)
+    except ValueError:
+        msg = "'%s' is not a valid value for '%s'" % (val, name)
+        if position is not None:
+            msg += ' (arg %d)' % position
+        raise _UsageError(msg + '.')
+
+def _parse(inputs, cmd):
+    """Return (cmd, args, opts) for `inputs`, starting with command `cmd`.
+
+    Values are left as strings, except flags, which are booleans.
+
+    """
+
+    inputs = iter(inputs)
+    args = []
+    opts = {}
+    literal = False
+
+    for item in inputs:
+        if literal or item == '-' or not item.startswith('-'):
+            if cmd is _MAIN and _COMMANDS and not args and not literal:
+                if item in _COMMANDS:
+                    cmd = _COMMANDS[item]
+                    continue
+                elif _MAIN is None:
+                    raise _UsageError("'%s' is not a known command." % item,
+                                      show_cmds=True)
+
+            max_argc = len(cmd[2]) + len(cmd[3])
+            if len(args) >= max_argc and cmd[5] is None:
+                raise _UsageError("'%s' takes at most %s %s." %
+                                  (cmd[0], max_argc,
+                                   'arg' if max_argc == 1 else 'args'))
+            args.append(item)
+            continue
+        elif item == '--':
+            literal = True
+            continue
+
+        if item.startswith('--'):
+            name, sep, val = item[2:].partition('=')
+            names = [name]
+        else:
+            names = item[1:]
+            val = None
+
+        last_opt = None
+        for name in names:
+            if last_opt is not None:
+                # The rest of a group of short names is the last one's value.
+                val += name
+                continue
+
+            opt = None
+            if cmd is not None:
+                opt = cmd[4].get(name)
+            if opt is None:
+                opt = _GLOBAL_OPTS.get(name)
+            if opt is None:
+                raise _UsageError("'%s' is not a known option." % name)
+            if opt[0] in opts:
+                raise _UsageError("You have passed options '%s' and '%s', "
+                                  "which are duplicates." % (opt[0], name))
+
+            if opt[2]:
+                opts[opt[0]] = not opt[3]
+            else:
+                last_opt = opt
+                if val is None:
+                    val = ''
+
+        if last_opt is not None:
+            if not val:
+                val = next(inputs, None)
+                if val is None:
+                    raise _UsageError("Option '%s' requires a value." %
+                                      last_opt[0])
+            opts[last_opt[0]] = val
+
+    if cmd is not None and len(args) < len(cmd[2]):
+        num_args = len(cmd[2])
+        raise _UsageError('You must enter at least %s %s.' %
+                          (num_args, 'arg' if num_args == 1 else 'args'))
+
+    return cmd, args, opts
+
+def _show_help(cmd=None, show_global_opts=False):
+    """Write help for the app, or for command `cmd`."""
+
+    help_msg = _HELP.get((cmd, show_global_opts))
+    if help_msg is None:
+        raise _UsageError("'%s' is not a known command." % cmd,
+                          show_cmds=True)
+
+    sys.stdout.write(help_msg)
+
+def _run(argv):
+    """Run the command `argv` specifies and return its exit code."""
+
+    cmd = None
+    try:
+        cmd, args, opts = _parse(argv[1:], _MAIN)
+        if cmd is None:
+            # No command was given, so just say what's available.
+            print >> sys.stderr, _AVAIL_CMDS
+            return 0
+
+        arg_specs = cmd[2] + cmd[3]
+        try:
+            for pos, val in enumerate(args):
+                if pos < len(arg_specs):
+                    args[pos] = _convert(arg_specs[pos][0], arg_specs[pos][1],
+                                         val)
+                else:
+                    args[pos] = _convert(cmd[5][0], cmd[5][1], val, pos + 1)
+
+            for name, val in opts.items():
+                opt = cmd[4].get(name) or _GLOBAL_OPTS[name]
+                if not opt[2]:
+                    opts[name] = _convert(opt[0], opt[4], val)
+        except:
+            # The command won't get to use values converted before the
+            # invalid one, so close any files they hold open.
+            for val in args + opts.values():
+                if getattr(val, '_close_after_run', False):
+                    val.close()
+            raise
+
+        # Take out global options, and pass the rest to the command. They
+        # can be given with help too, but only commands need them set, and
+        # the module that holds them imported.
+        global_opts = [opt for key, opt in _GLOBAL_OPTS.items()
+                       if key == opt[0]]
+        global_vals = [opts.pop(opt[0], None) for opt in global_opts]
+
+        if cmd[1] is None:
+            func = _show_help
+        else:
+            if global_opts:
+                __import__(_GLOBALS_MODULE)
+                module = sys.modules[_GLOBALS_MODULE]
+                for opt, val in zip(global_opts, global_vals):
+                    if val is None:
+                        val = _convert(opt[0], opt[4], opt[3])
+                    setattr(module, opt[1], val)
+
+            func = _load(cmd[1])
+
+        kwargs = dict((name.replace('-', '_'), val)
+                      for name, val in opts.items())
+        order = cmd[6]
+        if order is not None and len(args) > len(arg_specs):
+            # Python fills every param before *varargs by position, so
+            # options have to be passed that way too.
+            args[:len(arg_specs)] = [
+                args[src] if type(src) is int else
+                kwargs.pop(src, cmd[4][src.replace('_', '-')][3])
+                for src in order]
+        elif order is not None:
+            # Some options come before optional args, so pass args by name.
+            for spec, val in zip(arg_specs, args):
+                kwargs[spec[0].replace('-', '_')] = val
+            del args[:]
+        try:
+            exit_code = func(*args, **kwargs)
+        finally:
+            # Close files opened by converters like cmdline.MappedFile.
+            for val in args + kwargs.values():
+                if getattr(val, '_close_after_run', False):
+                    val.close()
+    except _UsageError as exc:
+        print >> sys.stderr, 'ERROR: %s' % exc
+        if exc.show_cmds:
+            print >> sys.stderr, _AVAIL_CMDS
+        elif cmd is not None and cmd is not _MAIN:
+            print >> sys.stderr, ("Run '%s help %s' for usage message." %
+                                  (_PROG, cmd[0]))
+        else:
+            print >> sys.stderr, "Run '%s help' for usage message." % _PROG
+
+        return 2
+
+    if hasattr(exit_code, '__iter__'):
+        _write_results(exit_code)
+        exit_code = None
+
+    if exit_code is None:
+        exit_code = 0
+
+    if type(exit_code) is int:
+        return exit_code
+
+def _write_results(results):
+    """Write each item of `results` to stdout on its own line, in chunks."""
+
+    import itertools
+
+    encoding = sys.stdout.encoding or 'utf-8'
+    chunk_size = 1 if sys.stdout.isatty() else 1024
+    results = iter(results)
+    while True:
+        chunk = list(itertools.islice(results, chunk_size))
+        if not chunk:
+            break
+
+        try:
+            text = '\n'.join(chunk)
+        except TypeError:
+            text = '\n'.join([item if isinstance(item, basestring)
+                               else str(item) for item in chunk])
+        if type(text) is unicode:
+            text = text.encode(encoding)
+
+        sys.stdout.write(text + '\n')
+
+    sys.stdout.flush()
+
+def main(argv=None):
+    """Run the command `argv` specifies, and exit with its exit code.
+
+    argv -- defaults to sys.argv.
+
+    """
+
+    if argv is None:
+        argv = sys.argv
+
+    try:
+        exit_code = _run(list(argv))
+    except IOError as exc:
+        import errno
+        import os
+        import signal
+
+        if exc.errno != errno.EPIPE:
+            raise
+
+        # stdout was closed early. Quietly exit as if killed by SIGPIPE.
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        exit_code = 128 + signal.SIGPIPE
+
+    if exit_code is not None:
+        sys.exit(exit_code)
+
+if __name__ == '__main__':
+    main()
+'''
+
+def _compile_opts(opts, main_module):
+    """Return an option index like _index_opts(), for App.compile().
+
+    It maps each name and short name to a tuple of (name, variable name,
+    is flag, default, type converter's import path).
+
+    """
+
+    import ast
+
+    index = {}
+    for opt in opts:
+        if opt.is_repeatable:
+            raise ValueError("Compiled apps can't take option '%s' more than "
+                             "once." % opt.name)
+
+        try:
+            ast.literal_eval(repr(opt.default))
+        except (SyntaxError, ValueError):
+            raise ValueError("Default %r of option '%s' cannot be written "
+                             "as a literal." % (opt.default, opt.name))
+
+        converter = None
+        if opt.type_converter is not None:
+            converter = _get_import_path(opt.type_converter, main_module)
+
+        spec = (opt.name, opt.name.replace('-', '_'), opt.is_flag,
+                opt.default, converter)
+        index[opt.name] = spec
+        if opt.short_name is not None:
+            index[opt.short_name] = spec
+
+    return index
+
+# First line of a completion index written by App.write_completion_index().
+# Bump the number whenever the format changes.
+_COMPLETION_HEADER = 'cmdline-completion\t2'
+
+# Printed by 'cmdline.py completion'. The completion index is read by awk, so
+# pressing Tab never starts Python, let alone imports an app.
+_COMPLETION_SCRIPT = r"""# Tab completion for programs written with cmdline.py, in bash or zsh.
+#
+# Source this from your shell's startup file, then register each program
+# along with the completion index its App writes:
+#
+#   cmdline_complete myprog ~/.myprog-completion
+
+if [ -n "$ZSH_VERSION" ]; then
+    autoload -U +X bashcompinit && bashcompinit
+fi
+
+# -g keeps it global when this is sourced from inside a function, as plugin
+# managers do.
+declare -gA _cmdline_indexes
+
+cmdline_complete() {
+    _cmdline_indexes[$1]=$2
+    complete -o default -F _cmdline_complete "$1"
+}
+
+_cmdline_awk='
+function opt_kind(name) {
+    if ((cmd, name) in kind) {
+        return kind[cmd, name]
+    }
+    if (("*", name) in kind) {
+        return kind["*", name]
+    }
+    return ""
+}
+
+BEGIN {
+    FS = "\t"
+    while ((getline line < index_path) > 0) {
+        split(line, field, "\t")
+        if (field[1] == "cmd") {
+            cmds[field[2]] = 1
+            has_cmds = 1
+        } else if (field[1] == "opt") {
+            kind[field[2], field[3]] = field[5]
+            if (field[4] != "") {
+                kind[field[2], field[4]] = field[5]
+            }
+            longs[field[2]] = longs[field[2]] " --" field[3]
+        }
+    }
+    cmd = "-"
+}
+
+NR > num_words { next }
+expect { expect = 0; next }
+literal { num_args++; next }
+$0 == "--" { literal = 1; next }
+/^--/ {
+    if (index($0, "=") == 0 && opt_kind(substr($0, 3)) == "value") {
+        expect = 1
+    }
+    next
+}
+/^-./ {
+    for (i = 2; i <= length($0); i++) {
+        if (opt_kind(substr($0, i, 1)) == "value") {
+            expect = i == length($0)
+            break
+        }
+    }
+    next
+}
+{
+    if (cmd == "-" && has_cmds && num_args == 0 && ($0 in cmds)) {
+        cmd = $0
+    } else {
+        num_args++
+    }
+}
+
+END {
+    if (expect) {
+        exit
+    }
+
+    num_cands = 0
+    if (!literal && cur ~ /^-/) {
+        num_cands = split(longs[cmd] longs["*"], cands, " ")
+    } else if (!literal && cmd == "-" && has_cmds && num_args == 0) {
+        for (name in cmds) {
+            cands[++num_cands] = name
+        }
+    }
+
+    for (i = 1; i <= num_cands; i++) {
+        if (index(cands[i], cur) == 1) {
+            print cands[i]
+        }
+    }
+}'
+
+_cmdline_complete() {
+    local index_path=${_cmdline_indexes[${1##*/}]}
+    COMPREPLY=()
+    [ -r "$index_path" ] || return 0
+
+    local IFS=$'\n'
+    COMPREPLY=($(printf '%s\n' "${COMP_WORDS[@]:1:COMP_CWORD-1}" |
+                 awk -v index_path="$index_path" \
+                     -v num_words=$((COMP_CWORD - 1)) \
+                     -v cur="${COMP_WORDS[COMP_CWORD]}" "$_cmdline_awk"))
+}
+"""
+
+class App(object):
+    """A command-line application."""
+
+    def __init__(self, usage_msg=None, arg_types={}, opt_args=[],
+                 cache_path=None, hooks=None, completion_index=None,
+                 response_files=False, max_repeats=None, output_format='text'):
+        """Create an App.
+
+        usage_msg -- optional string explaining this App to an end-user.
+                     PEP 257 says docstrings should be usable as a
+                     command-line module's usage statement, so this is
+                     usually __doc__.
+
+                     Anything that looks like a parameter description
+                     will be removed.
+
+        arg_types -- optional dict mapping arg names to callables that
+                     take a string as input and either return an object
+                     of the desired type or raise a ValueError.
+
+        opt_args -- optional list of arg names that should be treated as
+                    optional args instead of options.
+
+        cache_path -- optional path to a file for caching what commands'
+                      docstrings say between runs. See MetadataCache.
+                      Defaults to None, which disables caching.
+
+        hooks -- optional list of callables to report timed events to.
+                 See add_hook().
+
+        completion_index -- optional path to keep a completion index at,
+                            for the shell completer 'cmdline.py
+                            completion' prints. See
+                            write_completion_index(). run() rewrites it
+                            whenever the app's source files change.
+
+        response_files -- if True, an input like '@path' is replaced
+                          by the inputs listed in the file at `path`,
+                          for passing more inputs than the OS allows
+                          on one command line. Defaults to False. See
+                          _expand_response_files() for the format.
+
+        max_repeats -- optional max number of times a repeatable option
+                       can be given. See Option.is_repeatable. Defaults
+                       to None, which means there's no limit.
+
+        output_format -- optional format to write commands' results in.
+                         See run() for the formats, and the --format
+                         switch, which overrides this. Defaults to
+                         'text'.
+
+        """
+
+        self.hooks = list(hooks or [])
+        start = _clock() if self.hooks else None
+
+        self.cmd = None
+
+        # Commands that stream their results can set self.exit_code to
+        # choose the exit code. See _run(). While run_batch() runs lines
+        # on threads, it's kept in this threading.local instead, since
+        # every thread sees this App.
+        self._exit_code = None
+        self._thread_exit_codes = None
+
+        self.arg_types = arg_types
+        self.opt_args = opt_args
+        self.main_cmd = None
+        self.commands = {}
+        self.name = None
+        self.argv = []
+
+        # Parsed into self.usage_msg when first needed.
+        self._doc = _DocInfo(docstr=usage_msg)
+        self._usage_msg = _UNPARSED
+
+        # Stores the globals dict for whatever module this app was created in.
+        self.module_globals = None
+        self.global_opts = {}
+        self.global_opt_index = {}
+
+        # Number of the line being run by run_batch(), if any.
+        self._batch_line = None
+
+        # cProfile.Profile that commands run under, if --profile was given.
+        self._profiler = None
+
+        self.metadata_cache = None
+        if cache_path is not None:
+            self.metadata_cache = MetadataCache(cache_path)
+
+        self.completion_index = completion_index
+        self.response_files = response_files
+        self.max_repeats = max_repeats
+        self.output_format = output_format
+
+        # Rendered help, keyed by format_help()'s args. It's cleared
+        # whenever commands or options change.
+        self._help_cache = _LRUCache(32)
+
+        # Fields that support the main() and command() decorators.
+        # They hold whatever args were passed to the decorators.
+
+        # GRIPE They also have utterly lousy names. '_dec' stands for
+        # 'decorator', but I keep forgetting that. Find a better one. Or put
+        # these in a single dict, which would probably be simpler.
+        self._dec_short_names = None
+        self._dec_opt_args = None
+        self._dec_main_cmd = None
+        self._dec_arg_types = None
+        self._dec_usage_msg = None
+        self._dec_lazy_varargs = None
+
+        if start is not None:
+            self._fire('init', start)
+
+    def add_hook(self, hook):
+        """Call `hook` with timings of what this App does from now on.
+
+        `hook` is called as hook(event, secs, name). `secs` is how long
+        the event took and `name` is the name of the command involved,
+        or None. `event` is one of:
+
+        'init' -- creating the App (only seen by hooks passed to it).
+        'decorate' -- making a Command from a function.
+        'parse' -- parsing argv.
+        'convert' -- converting args' and options' values to their types.
+        'set_globals' -- setting global options' variables.
+        'run' -- running a command, whether it returns or raises.
+        'help' -- formatting help.
+
+        While an App has no hooks, nothing is timed.
+
+        """
+
+        self.hooks.append(hook)
+
+    def _fire(self, event, start, name=None):
+        """Report `event`, which began at `start`, to self.hooks.
+
+        Returns the time it was reported at, so it can start the next
+        event.
+
+        """
+
+        now = _clock()
+        for hook in self.hooks:
+            hook(event, now - start, name)
+
+        return now
+
+    @property
+    def usage_msg(self):
+        """String explaining this App, or None."""
+
+        if self._usage_msg is _UNPARSED:
+            usage_msg = self._doc.usage_msg
+            if usage_msg is not None:
+                usage_msg = usage_msg.strip()
+            self._usage_msg = usage_msg
+
+        return self._usage_msg
+
+    @usage_msg.setter
+    def usage_msg(self, value):
+        self._usage_msg = value
+        self._help_cache.clear()
+
+    @property
+    def exit_code(self):
+        """Exit code set by the running command, or None. See _run()."""
+
+        if self._thread_exit_codes is not None:
+            return getattr(self._thread_exit_codes, 'exit_code', None)
+
+        return self._exit_code
+
+    @exit_code.setter
+    def exit_code(self, value):
+        if self._thread_exit_codes is not None:
+            self._thread_exit_codes.exit_code = value
+        else:
+            self._exit_code = value
+
+    @property
+    def has_subcmds(self):
+        """Boolean indicating whether this app has subcommands."""
+
+        return len(self.commands) > 0
+
+    def _make_cmd(self, func, short_names=None, opt_args=None, arg_types=None,
+                  usage_msg=None, name=None, lazy_varargs=None):
+        """Return a Command for `func`, using this App's defaults.
+
+        The App's arg_types and opt_args are merged with those passed,
+        deferring to the ones passed.
+
+        """
+
+        # Merge self.arg_types with the command's arg_types, deferring to the
+        # command's data.
+        merged_arg_types = dict(self.arg_types)
+        if arg_types is not None:
+            merged_arg_types.update(arg_types)
+
+        if len(self.opt_args) > 0:
+            if opt_args is not None:
+                opt_args.extend(self.opt_args)
+            else:
+                opt_args = self.opt_args[:]
+
+        start = _clock() if self.hooks else None
+        cmd = Command.from_func(func, short_names, opt_args, merged_arg_types,
+                                usage_msg, name, self.metadata_cache,
+                                lazy_varargs)
+        if start is not None:
+            self._fire('decorate', start, cmd.name)
+
+        return cmd
+
+    def _add_help_cmd(self):
+        """Add a 'help' command to this App, if it doesn't have one."""
+
+        if 'help' not in self.commands:
+            start = _clock() if self.hooks else None
+            help_cmd = Command.from_func(self.show_help, name='help',
+                                         opt_args=['cmd'],
+                                         cache=self.metadata_cache)
+            if start is not None:
+                self._fire('decorate', start, help_cmd.name)
+
+            self.commands[help_cmd.name] = help_cmd
+
+    def _get_cmd(self, name):
+        """Return the subcommand called `name`, or None if there isn't one.
+
+        If the command was registered with lazy_command(), it is loaded
+        now, and replaces its LazyCommand in self.commands.
+
+        """
+
+        cmd = self.commands.get(name)
+        if isinstance(cmd, LazyCommand):
+            cmd = cmd.load(self)
+            self.commands[name] = cmd
+            self._help_cache.clear()
+
+        return cmd
+
+    def _cmd_decorator(self, func):
+        """Do the work of decorating func as a command.
+
+        Interprets private fields that store any params passed to the
+        actual decorators.
+
+        This exists so we can mostly hide the different behavior
+        of decorators with args vs. decorators without args from the end
+        user.
+
+        Really, we just want to avoid having two decorators with
+        virtually identical names for a single purpose. Who really wants
+        to worry about App.command() vs. App.command_args()?
+
+        We achieve this by requiring all args to our decorators to be
+        passed as keyword arguments. That's a little noxious, but I
+        think it's better than having two differently-named decorators
+        for what looks to a user like the same task.
+
+        """
+
+        cmd = self._make_cmd(func, self._dec_short_names, self._dec_opt_args,
+                             self._dec_arg_types, self._dec_usage_msg,
+                             lazy_varargs=self._dec_lazy_varargs)
+
+        if self._dec_main_cmd is True:
+            # This is the main command.
+            self.main_cmd = cmd
+        else:
+            # This is a subcommand.
+            self.commands[cmd.name] = cmd
+
+        self._add_help_cmd()
+        self._help_cache.clear()
+
+        # Empty state-transfer fields for next call.
+        self._dec_short_names = None
+        self._dec_opt_args = None
+        self._dec_arg_types = None
+        self._dec_usage_msg = None
+        self._dec_lazy_varargs = None
+
+        return func
+
+    def main(self, func=None, short_names=None, opt_args=None, arg_types=None,
+             lazy_varargs=None):
+        """Decorator to make func the main command for this app.
 
         All arguments to it *must* be passed as keyword args, like so:
 
@@ -605,23 +3138,28 @@ class App(object):
         way to avoid it.
 
         short_names -- dict mapping func's optional arg names to single
-            letters that can be used as short names.
+            letters that can be used as short names. Map a name to None
+            to give that option no short name.
         opt_args -- list of func's optional params that should be
             treated as optional command-line args instead of options.
         arg_types -- dict mapping optional param names to callables
             that take a string as input and return an object of the
             desired type (or raise a ValueError).
+        lazy_varargs -- name of a param of func to pass any args after
+            the others to, as a lazily converted iterator. See
+            Command.from_func().
 
         """
 
         kwargs_passed = False
         if (short_names is not None or opt_args is not None or
-            arg_types is not None):
+            arg_types is not None or lazy_varargs is not None):
             kwargs_passed = True
 
         self._dec_short_names = short_names
         self._dec_opt_args = opt_args
         self._dec_arg_types = arg_types
+        self._dec_lazy_varargs = lazy_varargs
 
         self._dec_main_cmd = True
 
@@ -637,7 +3175,7 @@ class App(object):
             return self._cmd_decorator(func)
 
     def command(self, func=None, short_names=None, opt_args=None,
-                arg_types=None, usage_msg=None):
+                arg_types=None, usage_msg=None, lazy_varargs=None):
         """Decorator to mark func as a command.
 
         All arguments to it *must* be passed as keyword args, like so:
@@ -655,7 +3193,8 @@ class App(object):
         names that perform the same task, however.
 
         short_names -- dict mapping func's optional arg names to single
-            letters that can be used as short names.
+            letters that can be used as short names. Map a name to None
+            to give that option no short name.
         opt_args -- list of func's optional params that should be
             treated as optional command-line args instead of options.
         arg_types -- dict mapping optional param names to callables
@@ -663,6 +3202,9 @@ class App(object):
             desired type (or raise a ValueError).
         usage_msg -- explanation of how to use the command. Defaults
                      a version of func's docstring.
+        lazy_varargs -- name of a param of func to pass any args after
+            the others to, as a lazily converted iterator. See
+            Command.from_func().
 
         """
 
@@ -670,13 +3212,15 @@ class App(object):
         # App.main(). This should be DRYed up.
         kwargs_passed = False
         if (usage_msg is not None or short_names is not None or
-            opt_args is not None or arg_types is not None):
+            opt_args is not None or arg_types is not None or
+            lazy_varargs is not None):
             kwargs_passed = True
 
         self._dec_short_names = short_names
         self._dec_opt_args = opt_args
         self._dec_arg_types = arg_types
         self._dec_usage_msg = usage_msg
+        self._dec_lazy_varargs = lazy_varargs
 
         self._dec_main_cmd = False
 
@@ -691,6 +3235,39 @@ class App(object):
             # Decorate func and return the result.
             return self._cmd_decorator(func)
 
+    def lazy_command(self, import_path, name=None, summary=None,
+                     short_names=None, opt_args=None, arg_types=None,
+                     usage_msg=None, lazy_varargs=None):
+        """Add a subcommand without importing the function that implements it.
+
+        The function's module is imported, and the function made into a
+        Command, only when the command is run or its help is shown. An
+        app with many subcommands in many modules then only pays to
+        import the one it runs:
+
+        >>> app.lazy_command('reports.build:run', name='build',
+        ...                  summary='Build all reports.')
+
+        import_path -- string naming the function, as 'module:function'.
+            The function may be an attribute of an attribute of the
+            module, as in 'module:Class.method'.
+        name -- optional command name. Defaults to the function's name,
+            with '_' replaced by '-'.
+        summary -- optional one-line summary of the command, shown in
+            the list of available commands. The function's docstring is
+            not consulted for it, as that would mean importing the
+            function.
+        short_names, opt_args, arg_types, usage_msg, lazy_varargs -- as
+            for App.command().
+
+        """
+
+        cmd = LazyCommand(import_path, name, summary, short_names, opt_args,
+                          arg_types, usage_msg, lazy_varargs)
+        self.commands[cmd.name] = cmd
+        self._add_help_cmd()
+        self._help_cache.clear()
+
     def make_global_opts(self, module_globals, arg_types):
         """Set up our global options from module_globals.
 
@@ -703,32 +3280,37 @@ class App(object):
                      treated as global options if they're in this
                      dict.
 
+        Global options' summaries are taken from parameter descriptions
+        in the usage message passed to the App constructor.
+
         """
 
         self.module_globals = module_globals
 
-        summaries = _get_param_summaries(self.usage_msg)
-
         for var_name, type_converter in arg_types.items():
             name = var_name.replace('_', '-')
             value = module_globals[var_name]
-            summary = None if var_name not in summaries else summaries[var_name]
-            opt = Option(name, summary, value, type_converter=type_converter)
+            opt = Option(name, None, value, type_converter=type_converter,
+                         doc=self._doc)
             self.global_opts[name] = opt
 
+        self.global_opt_index = _index_opts(self.global_opts.values())
+        self._help_cache.clear()
+
     @classmethod
-    def _format_opt_summaries(self, opts):
+    def _format_opt_summaries(self, opts, width=70):
         """Return a formatted list of option summaries.
 
         Meant as a helper method for self.show_help, really.
 
         opts -- a dict of Options, with option name as the key.
+        width -- optional max width of a line. Defaults to 70.
 
         """
 
         opt_summaries = []
         for opt in opts.values():
-            summary = opt.format_summary()
+            summary = opt.format_summary(width)
             if summary is not None:
                 opt_summaries.append(summary)
 
@@ -743,10 +3325,45 @@ class App(object):
 
         """
 
-        # DEBUG This should be calculated based on the App's current
-        # environment, not hardcoded.
-        width = 70
+        sys.stdout.write(self.format_help(cmd, show_global_opts))
+
+    def format_help(self, cmd=None, show_global_opts=False, width=None):
+        """Return help for this app as a string, as show_help() writes it.
+
+        Help is only rendered once for each combination of args; after
+        that it comes from a cache.
+
+        cmd -- optional string specifying a subcommand.
+        show_global_opts -- optional flag controlling whether global
+                            options are included. Defaults to False.
+        width -- optional max width of a line. Defaults to the width of
+                 the terminal stdout is attached to, if any (see
+                 _get_term_width()).
+
+        """
+
+        start = _clock() if self.hooks else None
+        if width is None:
+            width = _get_term_width(sys.stdout)
+
+        key = (self.name, cmd, show_global_opts, width, _doc_changes)
+        help_msg = self._help_cache.get(key)
+        if help_msg is None:
+            help_msg = self._render_help(cmd, show_global_opts, width)
+            self._help_cache.put(key, help_msg)
+
+        if start is not None:
+            self._fire('help', start, cmd)
+
+        return help_msg
+
+    def _render_help(self, cmd, show_global_opts, width):
+        """Return help for this app, for format_help() to cache."""
+
+        import textwrap
+
         sep = os.linesep * 2
+        output = []
 
         if cmd is None:
             cmd = self.main_cmd
@@ -757,25 +3374,27 @@ class App(object):
             show_global_opts = True
 
             if self.usage_msg is not None:
-                print self.usage_msg
-                print
+                output.append(self.usage_msg + sep)
 
             if self.has_subcmds and cmd is None:
-                print self.get_avail_cmds()
+                output.append(self.get_avail_cmds() + os.linesep)
 
                 # GRIPE Ugly - explicitly dumping global opts in this case,
                 # even though we're not showing any other info of this sort.
                 if show_global_opts:
-                    opt_summaries = self._format_opt_summaries(self.global_opts)
+                    opt_summaries = self._format_opt_summaries(self.global_opts,
+                                                               width)
                     if len(opt_summaries) > 0:
                         opt_summaries.insert(0, 'Global Options:')
-                        print
-                        print sep.join(opt_summaries)
-                return
+                        output.append(os.linesep + sep.join(opt_summaries) +
+                                      os.linesep)
+
+                return ''.join(output)
         else:
-            cmd = self.commands.get(cmd)
+            name = cmd
+            cmd = self._get_cmd(name)
             if cmd is None:
-                raise UnknownCommand(cmd)
+                raise UnknownCommand(name)
 
         app_name = self.name
         if cmd is not None and cmd is not self.main_cmd:
@@ -791,36 +3410,34 @@ class App(object):
 
         if usage_msg is not None:
             for paragraph in usage_msg.split('\n' * 2):
-                indent_level = 0
-                for char in paragraph:
-                    if char == ' ':
-                        indent_level += 1
-                        break
-
-                if indent_level == 0:
+                if not paragraph.startswith(' '):
                     usage_paras.append(textwrap.fill(paragraph, width))
                 else:
                     # As there was indentation, we leave the lines exactly as
                     # they were - could be a sample code block or similar.
                     usage_paras.append(paragraph)
 
-                indent_level = 0
-
             help_msg += sep.join(usage_paras)
 
         input_summaries = []
-        if cmd.max_argc > 0:
+        if cmd.max_argc > 0 or cmd.varargs is not None:
             arg_summaries = []
             for arg in cmd.args:
                 example += ' <%s>' % arg.name
-                summary = arg.format_summary()
+                summary = arg.format_summary(width)
                 if summary is not None:
                     # Only explain inputs that have explanations.
                     arg_summaries.append(summary)
 
-            for arg in cmd.opt_args:
-                example += ' [<%s>]' % arg.name
-                summary = arg.format_summary()
+            for arg in cmd.opt_args:
+                example += ' [<%s>]' % arg.name
+                summary = arg.format_summary(width)
+                if summary is not None:
+                    arg_summaries.append(summary)
+
+            if cmd.varargs is not None:
+                example += ' [<%s>...]' % cmd.varargs.name
+                summary = cmd.varargs.format_summary(width)
                 if summary is not None:
                     arg_summaries.append(summary)
 
@@ -828,7 +3445,7 @@ class App(object):
                 arg_summaries.insert(0, 'Arguments:')
                 input_summaries.extend(arg_summaries)
 
-        opt_summaries = self._format_opt_summaries(cmd.opts)
+        opt_summaries = self._format_opt_summaries(cmd.opts, width)
         if len(opt_summaries) > 0:
             # GRIPE It might be a nice touch to distinguish between
             # options and flags.
@@ -836,7 +3453,7 @@ class App(object):
             input_summaries.extend(opt_summaries)
 
         if show_global_opts:
-            opt_summaries = self._format_opt_summaries(self.global_opts)
+            opt_summaries = self._format_opt_summaries(self.global_opts, width)
             if len(opt_summaries) > 0:
                 opt_summaries.insert(0, 'Global Options:')
                 input_summaries.extend(opt_summaries)
@@ -850,7 +3467,10 @@ class App(object):
         sep = os.linesep * 2
         help_msg = sep.join(input_summaries)
 
-        print os.linesep.join([example + os.linesep, help_msg])
+        output.append(os.linesep.join([example + os.linesep, help_msg]))
+        output.append(os.linesep)
+
+        return ''.join(output)
 
     def get_avail_cmds(self):
         """Return a string listing this App's commands."""
@@ -871,8 +3491,14 @@ class App(object):
         It is a helper, only meant for use by `self._do_cmd`.
 
         `cmd` is the Command to run.
-        `args` is a list of argument values.
-        `opts` is a dict mapping option name to passed value.
+        `args` is a list of argument values, as given in argv. If cmd
+        has lazy varargs, the last item is an iterator over their
+        values, which reads the rest of argv as it goes.
+        `opts` is a dict mapping option name to passed value. Values
+        are as given in argv, except for flags, which are booleans, and
+        repeatable options, which map to lists of values.
+
+        Use self._convert_inputs() to convert values to their types.
 
         argv -- List of inputs to program, including executable name.
                 Defaults to `sys.argv`.
@@ -882,142 +3508,125 @@ class App(object):
         if argv is None:
             argv = sys.argv
 
-        self.name = argv[0]
+        # Read argv lazily, so it can be any iterable - a generator reading
+        # paths from a pipe works as well as a list.
+        argv = iter(argv)
+        self.name = next(argv)
+        if self.response_files:
+            argv = _expand_response_files(argv)
         cmd = self.main_cmd
-        inputs = argv[1:]
+        tokens = _ArgvTokenizer(argv)
 
         args = []
         opts = {}
+        lazy_varargs = None
 
-        known_opts = {}
-        def _add_known_opts(opts):
-            """Given an iterable of Options, add them to `known_opts`.
+        # Kept up to date as cmd changes, as there may be many args.
+        max_argc = 0 if cmd is None else cmd.max_argc
 
-            I don't like inline functions much, but this DRYs a few
-            lines fairly cleanly.
+        def _find_opt(name):
+            """Return the Option called `name`, or raise UnknownOption.
+
+            Options of the current command shadow global options.
 
             """
 
-            for opt in opts:
-                known_opts[opt.name] = opt
-                if opt.short_name is not None:
-                    known_opts[opt.short_name] = opt
+            opt = None
+            if cmd is not None:
+                opt = cmd.opt_index.get(name)
+            if opt is None:
+                opt = self.global_opt_index.get(name)
+            if opt is None:
+                raise UnknownOption(name)
+
+            return opt
 
-        _add_known_opts(self.global_opts.values())
+        def _add_value(opt, val):
+            """Add `val` to the list of values of repeatable Option `opt`."""
 
-        if cmd is not None:
-            _add_known_opts(cmd.opts.values())
+            vals = opts.setdefault(opt.name, [])
+            if self.max_repeats is not None and len(vals) >= self.max_repeats:
+                raise TooManyRepeats(opt.name, self.max_repeats)
+            vals.append(val)
 
         # When literal_inputs is True, items are treated as input to a Command,
         # and cannot be command names or options.
         literal_inputs = False
-        while len(inputs) > 0:
-            item = inputs.pop(0)
-
-            if item == '--':
+        for kind, item in tokens:
+            if kind is _END_OPTS:
                 literal_inputs = True
-                continue
-
-            if item.startswith('--') and not literal_inputs:
+            elif kind is _LONG_OPT:
                 # item is a long option name, possibly including a value.
-                item = item.strip('-')
                 opt_name, sep, val = item.partition('=')
 
-                for opt in known_opts.values():
-                    if opt_name == opt.short_name and (opt.name in opts or
-                                                       opt.short_name in opts):
-                        raise DuplicateOption(opt_name, opt.short_name)
-                    elif opt_name == opt.name and (opt.name in opts or
-                                                   opt.short_name in opts):
-                        raise DuplicateOption(opt_name, opt.name)
-
-                if opt_name not in known_opts:
-                    raise UnknownOption(opt_name)
+                # `opts` is keyed by canonical option name, so this catches
+                # an option passed under both its name and its short name.
+                opt = _find_opt(opt_name)
+                if opt.name in opts and not opt.is_repeatable:
+                    raise DuplicateOption(opt_name, opt.name)
 
-                opt = known_opts[opt_name]
                 if opt.is_flag:
-                    val = not opt.default
+                    opts[opt.name] = not opt.default
+                    continue
                 elif val == '':
-                    val = inputs.pop(0)
+                    val = tokens.value(opt.name)
 
-                opt_name = opt.name
-                opts[opt_name] = opt.convert_type(val)
-            elif item.startswith('-') and not literal_inputs:
+                if opt.is_repeatable:
+                    _add_value(opt, val)
+                else:
+                    opts[opt.name] = val
+            elif kind is _SHORT_OPTS:
                 # item is one or more short option names, possibly followed by
                 # a value. All but the last short name must be flags.
-                item = item.strip('-')
-
                 val = None
                 last_opt = None
-                for i, char in enumerate(item):
-                    if char not in known_opts and val is None:
-                        raise UnknownOption(char)
-
+                for char in item:
                     if val is not None:
                         val += char
                         continue
 
-                    # GRIPE This exact block (with a single name change)
-                    # appears in the long-option-name if, which is very sad.
-                    for opt in known_opts.values():
-                        if char == opt.short_name and (opt.name in opts or
-                                                       opt.short_name in opts):
-                            raise DuplicateOption(char, opt.short_name)
-                        elif char == opt.name and (opt.name in opts or
-                                                       opt.short_name in opts):
-                            raise DuplicateOption(char, opt.name)
-
-                    opt = known_opts[char]
+                    opt = _find_opt(char)
+                    if opt.name in opts and not opt.is_repeatable:
+                        raise DuplicateOption(char, opt.name)
+
                     if opt.is_flag:
-                        opt_name = opt.name
-                        opts[opt_name] = not opt.default
+                        opts[opt.name] = not opt.default
                     else:
-                        last_opt = char
+                        last_opt = opt
                         val = ''
 
                 if last_opt is not None:
-                    if val is None or '':
-                        val = inputs.pop(0)
+                    if not val:
+                        val = tokens.value(last_opt.name)
 
-                    last_opt = known_opts[last_opt]
-                    opt_name = last_opt.name
-                    opts[opt_name] = last_opt.convert_type(val)
+                    if last_opt.is_repeatable:
+                        _add_value(last_opt, val)
+                    else:
+                        opts[last_opt.name] = val
             else:
-                args_len = len(args)
-                if (cmd is self.main_cmd and self.has_subcmds and
-                    len(args) == 0 and not literal_inputs):
+                if (not args and not literal_inputs and
+                    cmd is self.main_cmd and self.has_subcmds):
                     # This may be a command name.
-                    cand = self.commands.get(item)
-                    if cand is None:
-                        if self.main_cmd is None:
-                            # A command must be specified.
-                            raise UnknownCommand(item)
-                        else:
-                            # This is a positional argument.
-                            args.append(item)
-                    else:
+                    cand = self._get_cmd(item)
+                    if cand is not None:
                         cmd = cand
-                        _add_known_opts(cmd.opts.values())
-                else:
-                    args.append(item)
-
-                if args_len < len(args):
-                    # A new arg was added - set its type.
-                    # GRIPE Doing this retroactively is ugly.
-                    arg_pos = len(args) - 1
-                    num_req_args = len(cmd.args)
-                    if arg_pos <= num_req_args - 1:
-                        # Required arg.
-                        arg = cmd.args[arg_pos]
-                    else:
-                        # Optional arg.
-                        if arg_pos >= cmd.max_argc:
-                            raise BadArgCount(cmd.name, cmd.min_argc,
-                                              cmd.max_argc, len(args))
-
-                        arg = cmd.opt_args[arg_pos - num_req_args - 1]
+                        max_argc = cmd.max_argc
+                        continue
+                    elif self.main_cmd is None:
+                        # A command must be specified.
+                        raise UnknownCommand(item)
+
+                # item is a positional argument.
+                if len(args) >= max_argc:
+                    if cmd.varargs is None:
+                        raise BadArgCount(cmd.name, cmd.min_argc,
+                                          cmd.max_argc, len(args) + 1)
+                    elif cmd.lazy_varargs:
+                        # The rest of argv is left for the command to read.
+                        lazy_varargs = itertools.chain((item,), tokens.rest())
+                        break
 
-                    args[-1] = arg.convert_type(args[-1])
+                args.append(item)
 
         if cmd is None:
             raise UnknownCommand()
@@ -1025,13 +3634,86 @@ class App(object):
         if len(args) < cmd.min_argc:
             raise BadArgCount(cmd.name, cmd.min_argc, cmd.max_argc, len(args))
 
+        if cmd.lazy_varargs:
+            args.append(iter(()) if lazy_varargs is None else lazy_varargs)
+
         return cmd, args, opts
 
+    def _convert_inputs(self, cmd, args, opts):
+        """Convert values from self._parse_argv() to their types in place.
+
+        cmd -- the Command `args` and `opts` were parsed for.
+
+        """
+
+        # Values like MappedFiles that were converted before one that's
+        # invalid are closed, as the command won't get to use them.
+        varargs_vals = []
+        try:
+            self._convert_values(cmd, args, opts, varargs_vals)
+        except:
+            _close_all([val for val in itertools.chain(
+                            args, opts.itervalues(), varargs_vals)
+                        if isinstance(val, _Input)])
+            raise
+
+    def _convert_values(self, cmd, args, opts, varargs_vals):
+        """Do the work of _convert_inputs().
+
+        varargs_vals -- list to collect converted values of *varargs in
+                        before they replace the ones in `args`.
+
+        """
+
+        num_fixed = len(args) - 1 if cmd.lazy_varargs else len(args)
+        arg_specs = cmd.args + cmd.opt_args
+        for pos, val in enumerate(args[:min(num_fixed, len(arg_specs))]):
+            args[pos] = arg_specs[pos].convert_type(val)
+
+        varargs = cmd.varargs
+        if varargs is not None and _is_bulk(varargs.type_converter):
+            # These are all read and converted in one go, and the command
+            # gets what the converter makes, rather than an iterator.
+            # from_func() only allows this for lazy varargs.
+            args[-1] = varargs.convert_all(args[-1], num_fixed + 1)
+        elif varargs is not None and varargs.type_converter is not None:
+            if cmd.lazy_varargs:
+                # These are converted as the command reads them.
+                args[-1] = varargs.convert_each(args[-1], num_fixed + 1)
+            else:
+                num_specs = len(arg_specs)
+                varargs_vals.extend(varargs.convert_each(args[num_specs:],
+                                                         num_specs + 1))
+                args[num_specs:] = varargs_vals
+
+        for name, val in opts.items():
+            # As in parsing, the command's options shadow global ones.
+            opt = cmd.opt_index.get(name)
+            if opt is None:
+                opt = self.global_opt_index[name]
+
+            if opt.is_repeatable:
+                opts[name] = opt.convert_values(val)
+            elif not opt.is_flag:
+                opts[name] = opt.convert_type(val)
+
     def _do_cmd(self, argv):
-        """Return result of running command specified by `argv`."""
+        """Return result of running command specified by `argv`.
+
+        If self has hooks, each step is timed and reported to them.
+
+        """
+
+        start = _clock() if self.hooks else None
 
         cmd, args, opts = self._parse_argv(argv)
         self.cmd = cmd
+        if start is not None:
+            start = self._fire('parse', start, cmd.name)
+
+        self._convert_inputs(cmd, args, opts)
+        if start is not None:
+            start = self._fire('convert', start, cmd.name)
 
         # Set any global options.
         for name, opt in self.global_opts.items():
@@ -1039,12 +3721,17 @@ class App(object):
             if val is not None:
                 # Don't pass the command options it doesn't know.
                 del opts[name]
-            else:
+            elif opt.is_repeatable:
                 val = opt.default
+            else:
+                val = opt.convert_type(opt.default)
 
             var_name = name.replace('-', '_')
 
-            self.module_globals[var_name] = opt.convert_type(val)
+            self.module_globals[var_name] = val
+
+        if start is not None:
+            start = self._fire('set_globals', start, cmd.name)
 
         # Convert option names into variable names for use as **kwargs.
         for opt_name, value in opts.items():
@@ -1052,12 +3739,35 @@ class App(object):
             del opts[opt_name]
             opts[var_name] = value
 
-        return cmd.run(args, opts)
+        if cmd.lazy_varargs:
+            opts[cmd.varargs.name.replace('-', '_')] = args.pop()
+
+        if start is None:
+            return cmd.run(args, opts)
+
+        try:
+            return cmd.run(args, opts)
+        finally:
+            self._fire('run', start, cmd.name)
+
+    def _show_err_msg(self, msg, show_cmds=False):
+        """Display an error message to `sys.stderr`.
+
+        msg -- the error message.
+        show_cmds -- if True, list the available commands after `msg`,
+                     rather than suggesting the user ask for help.
+
+        """
+
+        prefix = ''
+        if self._batch_line is not None:
+            prefix = 'line %d: ' % self._batch_line
 
-    def _show_err_msg(self, msg):
-        """Display an error message to `sys.stderr`."""
+        print >> sys.stderr, '%sERROR: %s' % (prefix, msg)
 
-        print >> sys.stderr, 'ERROR: %s' % msg
+        if show_cmds:
+            print >> sys.stderr, self.get_avail_cmds()
+            return
 
         if self.cmd is not self.main_cmd and self.cmd is not None:
             help_msg = "Run '%s help %s' for usage message." % (self.name,
@@ -1067,37 +3777,22 @@ class App(object):
 
         print >> sys.stderr, help_msg
 
-    def run(self, argv=None):
-        """Run this app with argv as command-line input.
-
-        argv -- defaults to sys.argv, but pass another list if you like.
-
-        """
-
-        if argv is None:
-            argv = sys.argv
+    def _report_err(self, exc):
+        """Explain InvalidInput `exc` on stderr and return an exit code."""
 
-        err_msg = None
-        try:
-            exit_code = self._do_cmd(argv)
-            if exit_code is None:
-                # If we haven't been told otherwise, assume things worked.
-                exit_code = 0
+        if isinstance(exc, UnknownCommand):
+            # We want to display the available commands in this case.
+            if exc.input is None:
+                # No command was given, so just say what's available.
+                print >> sys.stderr, self.get_avail_cmds()
+                return 0
 
-            if type(exit_code) is int and (exit_code >= 0 or exit_code <= 127):
-                sys.exit(exit_code)
-        except UnknownCommand as exc:
-            # We want to display the available commands in this case, so we
-            # don't populate err_msg.
-            msg = None
-            if exc.input is not None:
-                msg = "ERROR: '%s' is not a known command." % exc.input
+            msg = "'%s' is not a known command." % exc.input
+            self._show_err_msg(msg, show_cmds=True)
 
-            if msg is not None:
-                print >> sys.stderr, 'ERROR: %s' % msg
+            return _USAGE_ERR_CODE
 
-            print >> sys.stderr, self.get_avail_cmds()
-        except BadArgCount as exc:
+        if isinstance(exc, BadArgCount):
             arg_str = 'arg' if exc.max_argc is 1 else 'args'
             if exc.num_given > exc.max_argc:
                 err_msg = "'%s' takes at most %s %s." % (exc.input,
@@ -1106,18 +3801,974 @@ class App(object):
             else:
                 err_msg = 'You must enter at least %s %s.' % (exc.min_argc,
                                                               arg_str)
-        except ValueError as exc:
-            err_msg = "'%s' is not a valid value for '%s'." % (exc.value,
-                                                               exc.input)
-        except UnknownOption as exc:
+        elif isinstance(exc, UnknownOption):
             err_msg = "'%s' is not a known option." % exc.input
-        except DuplicateOption as exc:
+        elif isinstance(exc, (InvalidOption, InvalidArg)):
+            if exc.input is None:
+                err_msg = "Option '%s' requires a value." % exc.name
+            else:
+                err_msg = "'%s' is not a valid value for '%s'." % (exc.input,
+                                                                   exc.name)
+                if getattr(exc, 'position', None) is not None:
+                    err_msg = err_msg[:-1] + ' (arg %d).' % exc.position
+        elif isinstance(exc, DuplicateOption):
             err_msg = ("You have passed options '%s' and '%s', which are "
                        "duplicates.")
             err_msg = err_msg % (exc.name, exc.input)
-        except InvalidInput as exc:
+        elif isinstance(exc, TooManyRepeats):
+            err_msg = "Option '%s' can be given at most %d times." % (
+                exc.input, exc.max_repeats)
+        elif isinstance(exc, BadResponseFile):
+            err_msg = "Could not read response file '%s': %s." % (exc.input,
+                                                                  exc.reason)
+        elif isinstance(exc, BadBatchFile):
+            err_msg = "Could not read batch file '%s': %s." % (exc.input,
+                                                               exc.reason)
+        else:
             err_msg = "'%s' is invalid input." % exc.input
 
-        if err_msg is not None:
-            self._show_err_msg(err_msg)
-            sys.exit(_USAGE_ERR_CODE)
+        self._show_err_msg(err_msg)
+
+        return _USAGE_ERR_CODE
+
+    def _split_app_switches(self, argv):
+        """Return (switches, argv) after taking App-level switches off argv.
+
+        App-level switches, like --batch, are handled by the App itself
+        rather than passed to a command, and must come before anything
+        else in argv. A global option or main command option with the
+        same name takes precedence over an App-level switch.
+
+        `switches` is a dict mapping switch name to value. `argv` is an
+        iterator over what's left of argv, starting with the program
+        name.
+
+        """
+
+        argv = iter(argv)
+        prog_name = self.name = next(argv)
+        switches = {}
+
+        for item in argv:
+            name, sep, val = item[2:].partition('=')
+            if (not item.startswith('--') or name not in _APP_SWITCHES or
+                name in self.global_opt_index or
+                (self.main_cmd is not None and name in self.main_cmd.opt_index)):
+                # Put item back - it's for a command.
+                argv = itertools.chain([item], argv)
+                break
+
+            takes_value = _APP_SWITCHES[name]
+            if takes_value is None:
+                takes_value = bool(sep)
+            elif takes_value and not sep:
+                val = next(argv, None)
+                if val is None:
+                    raise InvalidOption(name)
+
+            switches[name] = val if takes_value else True
+
+        return switches, itertools.chain([prog_name], argv)
+
+    def _run(self, argv):
+        """Run the command `argv` specifies and return its exit code.
+
+        If the command returns an iterable, like a list or a generator,
+        its items are written to stdout in self.output_format, and the
+        exit code is self.exit_code, which the command can set while it
+        runs. It's also used if the command returns None.
+
+        Invalid input is reported on stderr, not raised. Returns None if
+        the command returned something other than an exit code.
+
+        """
+
+        self.cmd = None
+        self.exit_code = None
+        try:
+            try:
+                if self._profiler is None:
+                    exit_code = self._do_cmd(argv)
+                    if hasattr(exit_code, '__iter__'):
+                        exit_code = self._write_results(exit_code)
+                else:
+                    exit_code = self._profiler.runcall(self._do_cmd, argv)
+                    if hasattr(exit_code, '__iter__'):
+                        exit_code = self._profiler.runcall(
+                            self._write_results, exit_code)
+            except InvalidInput as exc:
+                return self._report_err(exc)
+        finally:
+            # Commands may have been loaded lazily while running, and
+            # reporting an error may have listed their summaries, so this
+            # is the last chance to cache what we learned.
+            if self.metadata_cache is not None:
+                self.metadata_cache.save()
+
+        if exit_code is None:
+            # If we haven't been told otherwise, assume things worked.
+            exit_code = self.exit_code or 0
+
+        if type(exit_code) is int:
+            return exit_code
+
+    def _write_results(self, results):
+        """Write the items of iterable `results` to stdout.
+
+        They're written in self.output_format, by one of the encoders in
+        _OUTPUT_FORMATS. Items are encoded and written in chunks, rather
+        than one at a time, unless stdout is a terminal. Unicode is
+        encoded with stdout's encoding, or UTF-8.
+
+        Returns None, so the caller falls back to self.exit_code.
+
+        """
+
+        stdout = sys.stdout
+        encoding = getattr(stdout, 'encoding', None) or 'utf-8'
+        encode = _OUTPUT_FORMATS[self.output_format](encoding).encode
+        isatty = getattr(stdout, 'isatty', None)
+        chunk_size = 1 if isatty is not None and isatty() else _RESULT_CHUNK
+
+        results = iter(results)
+        while True:
+            chunk = list(itertools.islice(results, chunk_size))
+            if not chunk:
+                break
+
+            stdout.write(encode(chunk))
+
+        stdout.flush()
+
+    def _run_batch_line(self, line_num, line):
+        """Run the command on line `line_num` of a batch.
+
+        Returns the command's exit code, or None if `line` holds no
+        command.
+
+        """
+
+        import shlex
+
+        # Don't let an error on this line blame the previous line's command.
+        self.cmd = None
+        self._batch_line = line_num
+        try:
+            try:
+                argv = shlex.split(line, comments=True)
+            except ValueError as exc:
+                self._show_err_msg(str(exc))
+                return _USAGE_ERR_CODE
+
+            if not argv:
+                return None
+
+            try:
+                exit_code = self._run([self.name] + argv)
+            except SystemExit as exc:
+                exit_code = _exit_status(exc)
+            except Exception:
+                # One command failing shouldn't stop the rest of the batch.
+                import traceback
+                sys.stderr.write('line %d: %s' % (line_num,
+                                                  traceback.format_exc()))
+                return 1
+
+            return exit_code or 0
+        finally:
+            self._batch_line = None
+
+    def run_batch(self, stream, buffered=False, jobs=1, ordered=True,
+                  threads=False):
+        """Run a command for each line in `stream`, all in this process.
+
+        Each line is split the way a shell would split it (see
+        shlex.split()) and run as if it were this App's argv, minus the
+        program name. Blank lines and '#' comments are skipped.
+
+        This saves starting Python, and setting up the App, once per
+        command, which dominates the cost of running cheap commands
+        many times from a shell loop.
+
+        Errors, including exceptions raised by commands, are reported on
+        stderr, prefixed with the line number, and don't stop later
+        lines from running. A line whose command raised an exception
+        gets exit code 1. Nothing here calls
+        sys.exit() - if a command does, that ends its line, with the
+        exit code it passed.
+
+        stream -- iterable of lines, such as a file object.
+        buffered -- optional flag. If False, the default, stdout and
+                    stderr are flushed after each line. If True, output
+                    is left to Python's buffering, which is faster.
+        jobs -- optional number of worker processes to spread lines
+                across. Defaults to 1, which runs every line in this
+                process. Workers are forked when this is called, so
+                they start with every command already set up. Each
+                line's output is collected in its worker and written
+                out in one piece, so lines' output never interleaves.
+        ordered -- optional flag, only used if `jobs` is more than 1.
+                   If True, the default, lines' output is written in
+                   the order the lines came in. If False, it is written
+                   as soon as each line finishes.
+        threads -- optional flag, only used if `jobs` is more than 1. If
+                   True, lines are spread across threads rather than
+                   processes. That suits commands that spend their time
+                   waiting on I/O, which can then wait concurrently.
+                   Defaults to False.
+
+                   Threads share module globals, so global options can't
+                   safely differ between lines run on threads.
+
+        Returns a list of (line number, exit code) pairs, one for each
+        line that held a command, in the order their output was written.
+
+        """
+
+        if self.name is None:
+            self.name = sys.argv[0]
+
+        lines = enumerate(stream, 1)
+        if jobs > 1 and threads:
+            return self._run_batch_threads(lines, buffered, jobs, ordered)
+        elif jobs > 1:
+            return self._run_batch_pool(lines, buffered, jobs, ordered)
+
+        results = []
+        for line_num, line in lines:
+            exit_code = self._run_batch_line(line_num, line)
+            if exit_code is None:
+                continue
+
+            results.append((line_num, exit_code))
+
+            if not buffered:
+                sys.stdout.flush()
+                sys.stderr.flush()
+
+        return results
+
+    def _run_batch_pool(self, lines, buffered, jobs, ordered):
+        """Do the work of run_batch() with a pool of `jobs` processes.
+
+        lines -- iterable of (line number, line) pairs.
+
+        """
+
+        global _pool_app
+
+        import multiprocessing
+
+        # Workers are forked, so they find this App here.
+        _pool_app = self
+        try:
+            pool = multiprocessing.Pool(jobs, _init_pool_worker)
+            return self._collect_batch(pool, _run_pool_line, lines, buffered,
+                                       ordered, sys.stdout, sys.stderr)
+        finally:
+            _pool_app = None
+
+    def _run_batch_threads(self, lines, buffered, jobs, ordered):
+        """Do the work of run_batch() with a pool of `jobs` threads.
+
+        lines -- iterable of (line number, line) pairs.
+
+        """
+
+        import copy
+        import threading
+        from multiprocessing.pool import ThreadPool
+
+        stdout, stderr = sys.stdout, sys.stderr
+        local = threading.local()
+
+        # Commands set exit_code on this App, not the thread's copy, so
+        # each thread needs its own. The copies share this local.
+        self._thread_exit_codes = threading.local()
+
+        def _run_thread_line(numbered_line):
+            """Run a batch line, returning what _run_pool_line() does."""
+
+            # Each thread gets its own shallow copy of this App, so state
+            # like self.cmd isn't shared between lines. The metadata cache
+            # is only saved from this thread, once the batch is done.
+            app = getattr(local, 'app', None)
+            if app is None:
+                app = local.app = copy.copy(self)
+                app.metadata_cache = None
+                # cProfile can only profile the thread that's running it.
+                app._profiler = None
+                app._help_cache = _LRUCache(32)
+
+            line_num, line = numbered_line
+            sys.stdout.capture()
+            sys.stderr.capture()
+            try:
+                exit_code = app._run_batch_line(line_num, line)
+            finally:
+                out = sys.stdout.release()
+                err = sys.stderr.release()
+
+            return line_num, exit_code, out, err
+
+        sys.stdout, sys.stderr = _ThreadOutput(stdout), _ThreadOutput(stderr)
+        try:
+            pool = ThreadPool(jobs)
+            return self._collect_batch(pool, _run_thread_line, lines,
+                                       buffered, ordered, stdout, stderr)
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+            self._thread_exit_codes = None
+            if self.metadata_cache is not None:
+                self.metadata_cache.save()
+
+    def _collect_batch(self, pool, func, lines, buffered, ordered, stdout,
+                       stderr):
+        """Run batch `lines` in `pool` with `func`, and write their output.
+
+        Returns what run_batch() does. `pool` is closed when done.
+
+        func -- callable taking a (line number, line) pair and returning
+                (line number, exit code, stdout, stderr).
+        stdout, stderr -- file objects to write each line's output to.
+
+        """
+
+        try:
+            if ordered:
+                outputs = pool.imap(func, lines)
+            else:
+                outputs = pool.imap_unordered(func, lines)
+
+            results = []
+            while True:
+                # Waiting with a timeout lets KeyboardInterrupt through.
+                try:
+                    line_num, exit_code, out, err = outputs.next(_POOL_TIMEOUT)
+                except StopIteration:
+                    break
+
+                stdout.write(out)
+                stderr.write(err)
+                if exit_code is None:
+                    continue
+
+                results.append((line_num, exit_code))
+
+                if not buffered:
+                    stdout.flush()
+                    stderr.flush()
+
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        return results
+
+    def serve(self, socket_path, preload=True):
+        """Serve this App on a Unix domain socket, for call_server() to use.
+
+        Starting Python, importing modules and setting up an App can
+        take much longer than running a command. A server does all that
+        once, then forks a copy of itself for each client, which runs
+        the client's command with the client's argv, working directory,
+        environment, stdin, stdout and stderr.
+
+        Runs until interrupted or sent SIGTERM, then removes the socket.
+        Only the user running the server can connect to it.
+
+        Commands run this way see stdin, stdout and stderr as file-like
+        objects, not real files - they have no fileno().
+
+        socket_path -- path to create the socket at. A socket already
+                       there is replaced.
+        preload -- optional flag. If True, the default, commands added
+                   with lazy_command() are loaded before serving, so no
+                   client has to wait for them.
+
+        """
+
+        import socket
+        import stat
+
+        if preload:
+            for name in list(self.commands):
+                self._get_cmd(name)
+
+        try:
+            if stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                os.remove(socket_path)
+        except OSError:
+            pass
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(077)
+        try:
+            server.bind(socket_path)
+        finally:
+            os.umask(old_umask)
+        server.listen(128)
+
+        def _stop(signum, frame):
+            sys.exit(0)
+
+        # Have finished clients reaped automatically, and clean up on
+        # SIGTERM as well as on KeyboardInterrupt.
+        old_handlers = {
+            signal.SIGCHLD: signal.signal(signal.SIGCHLD, signal.SIG_IGN),
+            signal.SIGTERM: signal.signal(signal.SIGTERM, _stop),
+        }
+        try:
+            while True:
+                try:
+                    conn, addr = server.accept()
+                except socket.error as exc:
+                    if exc.errno == errno.EINTR:
+                        continue
+                    raise
+
+                if os.fork() == 0:
+                    exit_code = 1
+                    try:
+                        server.close()
+                        for signum, handler in old_handlers.items():
+                            signal.signal(signum, handler)
+                        exit_code = self._serve_client(conn)
+                    finally:
+                        os._exit(exit_code)
+
+                conn.close()
+        finally:
+            for signum, handler in old_handlers.items():
+                signal.signal(signum, handler)
+            server.close()
+            os.remove(socket_path)
+
+    def _serve_client(self, conn):
+        """Run a command for the client on `conn`, and return its exit code.
+
+        This runs in a child process forked by self.serve(), and is free
+        to change process-wide state.
+
+        """
+
+        import struct
+
+        kind, request = _recv_frame(conn)
+        if kind != 'R':
+            return 1
+
+        argv, cwd, env = marshal.loads(request)
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(env)
+        sys.argv = argv
+
+        sys.stdin = _RemoteInput(conn)
+        sys.stdout = _RemoteOutput(conn, 'O')
+        sys.stderr = _RemoteOutput(conn, 'E')
+
+        exit_code = 0
+        try:
+            self.run(argv)
+        except SystemExit as exc:
+            exit_code = _exit_status(exc)
+        except Exception:
+            import traceback
+            traceback.print_exc()
+            exit_code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+
+        _send_frame(conn, 'X', struct.pack('>i', exit_code))
+
+        return exit_code
+
+    def write_completion_index(self, path):
+        """Write an index of this App's commands and options to `path`.
+
+        The shell completer 'cmdline.py completion' prints reads it, so
+        completing a command line doesn't import the app. It lists each
+        command, option and positional arg, and the source files of
+        the modules they come from, so the App can tell when it's out
+        of date (see App.__init__'s completion_index kwarg).
+
+        Lazy commands are loaded, to find out their options. The file is
+        replaced atomically, so the completer never sees half of it.
+
+        """
+
+        cmds = []
+        if self.main_cmd is not None:
+            cmds.append(('-', self.main_cmd))
+        for name in sorted(self.commands):
+            cmds.append((name, self._get_cmd(name)))
+
+        sources = set()
+        modules = [sys.modules.get(cmd.func.__module__) for name, cmd in cmds]
+        if self.module_globals is not None:
+            modules.append(sys.modules.get(self.module_globals['__name__']))
+        for module in modules:
+            filename = MetadataCache._source_file(module)
+            if filename is not None and os.path.exists(filename):
+                sources.add(filename)
+
+        lines = [_COMPLETION_HEADER]
+        for filename in sorted(sources):
+            lines.append('source\t%s\t%r' % (filename,
+                                             os.stat(filename).st_mtime))
+
+        def _add_opts(cmd_name, opts):
+            for opt in sorted(opts.values(), key=lambda opt: opt.name):
+                lines.append('opt\t%s\t%s\t%s\t%s' % (
+                    cmd_name, opt.name, opt.short_name or '',
+                    'flag' if opt.is_flag else 'value'))
+
+        for name, cmd in cmds:
+            if name != '-':
+                lines.append('cmd\t%s' % name)
+            for pos, arg in enumerate(cmd.args + cmd.opt_args):
+                required = 'required' if pos < len(cmd.args) else 'optional'
+                lines.append('arg\t%s\t%d\t%s\t%s' % (name, pos, arg.name,
+                                                      required))
+            if cmd.varargs is not None:
+                lines.append('arg\t%s\t%d\t%s\tvarargs' % (
+                    name, cmd.max_argc, cmd.varargs.name))
+            _add_opts(name, cmd.opts)
+        _add_opts('*', self.global_opts)
+
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'w') as index:
+            index.write('\n'.join(lines) + '\n')
+        os.rename(tmp_path, path)
+
+    def _completion_index_is_stale(self, path):
+        """Return True if the completion index at `path` is out of date.
+
+        Only the index's first lines, which list its source files, are
+        read, so this is cheap enough to do on every run.
+
+        """
+
+        try:
+            with open(path) as index:
+                if index.readline().rstrip('\n') != _COMPLETION_HEADER:
+                    return True
+
+                for line in index:
+                    fields = line.rstrip('\n').split('\t')
+                    if fields[0] != 'source':
+                        return False
+                    if repr(os.stat(fields[1]).st_mtime) != fields[2]:
+                        return True
+        except (IOError, OSError, IndexError):
+            return True
+
+        return False
+
+    def compile(self, path, prog=None, width=70, module=None):
+        """Write a module to `path` that runs this App's commands.
+
+        The module holds this App's commands, options and help in
+        tables of literals, and parses argv with its own small parser.
+        Running it, or calling its main(), works like calling run() on
+        this App. But it doesn't import cmdline, inspect functions or
+        parse docstrings, and it imports only the module of the command
+        being run. Showing help imports nothing at all.
+
+        It doesn't handle App-level switches like --batch or look at
+        App.exit_code, and it must be regenerated whenever the App
+        changes. Apps that read response files, or have commands with
+        lazy varargs, can't be compiled.
+
+        Raises ValueError if a command, type converter or option default
+        can't be written into the module. Commands and converters must
+        be module-level names, and defaults must be literals.
+
+        prog -- optional program name to show in help and error
+                messages. Defaults to the name this App was run as, if
+                any, or sys.argv[0].
+        width -- optional max width of a line of help. Defaults to 70.
+        module -- optional name to import functions defined in __main__
+                  by. Defaults to the __main__ script's file name.
+
+        """
+
+        import pprint
+
+        if self.response_files:
+            raise ValueError("compiled apps can't read response files")
+
+        if prog is None:
+            prog = self.name or os.path.basename(sys.argv[0])
+
+        if module is None:
+            main_file = getattr(sys.modules['__main__'], '__file__', '')
+            module = os.path.splitext(os.path.basename(main_file))[0]
+
+        # Lazy commands know their import paths, which may name things
+        # _get_import_path() can't, like 'module:Class.method'.
+        targets = {}
+        for name, cmd in self.commands.items():
+            if isinstance(cmd, LazyCommand):
+                targets[name] = cmd.import_path
+
+        old_name, self.name = self.name, prog
+        try:
+            avail_cmds = self.get_avail_cmds()
+            help_msgs = {}
+            for name in [None] + self.commands.keys():
+                for show_global_opts in (False, True):
+                    help_msgs[name, show_global_opts] = self.format_help(
+                        name, show_global_opts, width)
+        finally:
+            self.name = old_name
+
+        def _compile_cmd(cmd, target):
+            """Return the tuple describing `cmd` in the module's tables."""
+
+            if target is None and cmd.func != self.show_help:
+                target = _get_import_path(cmd.func, module)
+
+            if cmd.lazy_varargs:
+                raise ValueError("compiled apps can't pass lazy varargs to "
+                                 "'%s'" % cmd.name)
+
+            args = []
+            for arg in cmd.args + cmd.opt_args + [cmd.varargs]:
+                converter = None
+                if arg is not None and arg.type_converter is not None:
+                    converter = _get_import_path(arg.type_converter, module)
+                args.append(None if arg is None else (arg.name, converter))
+
+            varargs = args.pop()
+            return (cmd.name, target, args[:len(cmd.args)],
+                    args[len(cmd.args):], _compile_opts(cmd.opts.values(),
+                                                        module), varargs,
+                    cmd._find_param_order())
+
+        commands = {}
+        for name in self.commands:
+            commands[name] = _compile_cmd(self._get_cmd(name),
+                                          targets.get(name))
+
+        main_cmd = None
+        if self.main_cmd is not None:
+            main_cmd = _compile_cmd(self.main_cmd, None)
+
+        globals_module = None
+        if self.module_globals is not None:
+            globals_module = self.module_globals['__name__']
+            if globals_module == '__main__':
+                globals_module = module
+
+        tables = [
+            ('_PROG', prog),
+            ('_MAIN', main_cmd),
+            ('_COMMANDS', commands),
+            ('_GLOBAL_OPTS', _compile_opts(self.global_opts.values(), module)),
+            ('_GLOBALS_MODULE', globals_module),
+            ('_AVAIL_CMDS', avail_cmds),
+            ('_HELP', help_msgs),
+        ]
+
+        lines = ['"""Runs the commands of %s.' % prog,
+                 '',
+                 'Generated by cmdline.App.compile(). Regenerate it rather than',
+                 'editing it.',
+                 '',
+                 '"""',
+                 '',
+                 'import sys',
+                 '',
+                 '# Commands are (name, import path, args, optional args,',
+                 '# options, varargs, param order). Args are (name,',
+                 '# converter). Options are indexed by name and short name,',
+                 '# and are (name, variable name, is flag, default,',
+                 '# converter). Varargs are (name, converter), or None.',
+                 "# Param order is None if the args are the function's",
+                 '# leading params and there are no varargs. Otherwise it has',
+                 '# an item for each param before *varargs, in order: the',
+                 "# position of an arg, or an option's variable name. The",
+                 '# help command has no import path.']
+        for var_name, value in tables:
+            lines.append('%s = %s' % (var_name, pprint.pformat(value)))
+
+        with open(path, 'w') as compiled:
+            compiled.write('\n'.join(lines) + '\n' + _COMPILED_RUNTIME)
+
+    def run(self, argv=None):
+        """Run this app with argv as command-line input.
+
+        argv -- defaults to sys.argv, but pass another list if you like.
+
+        If argv starts with '--batch FILE', commands are read from FILE
+        ('-' means stdin) and run by self.run_batch(). The exit code is
+        then the highest exit code of any of them. Adding '--jobs N'
+        spreads the commands over N processes, or N threads if
+        '--threads' is also given.
+
+        If argv starts with '--serve SOCKET', self.serve() is called
+        with SOCKET.
+
+        If argv starts with '--profile', commands run under cProfile
+        and the functions they spent most time in are listed on stderr.
+        '--profile=FILE' writes the stats to FILE for pstats instead.
+        With --jobs, only commands run in this process are profiled.
+
+        If argv starts with '--format FORMAT', what commands return is
+        written in FORMAT, which is one of 'text' (each item on a line of
+        its own), 'jsonl' (each item as JSON on a line of its own), 'csv'
+        or 'tsv'. For CSV and TSV, items should be tuples, lists or
+        dicts, and if they're dicts, the first one's keys become a
+        header. See _run().
+
+        If stdout is closed early, as when piped to head, this exits
+        quietly with the status a process killed by SIGPIPE would have.
+
+        """
+
+        if argv is None:
+            argv = sys.argv
+
+        try:
+            switches, argv = self._split_app_switches(argv)
+            jobs = switches.get('jobs', '1')
+            try:
+                jobs = int(jobs)
+            except ValueError:
+                raise InvalidOption('jobs', jobs)
+
+            output_format = switches.get('format', self.output_format)
+            if output_format not in _OUTPUT_FORMATS:
+                raise InvalidOption('format', output_format)
+            self.output_format = output_format
+        except InvalidInput as exc:
+            sys.exit(self._report_err(exc))
+
+        if (self.completion_index is not None and
+            self._completion_index_is_stale(self.completion_index)):
+            try:
+                self.write_completion_index(self.completion_index)
+            except (IOError, OSError):
+                # Completion just won't work until it can be written.
+                pass
+
+        profile_path = switches.get('profile')
+        if profile_path is not None:
+            import cProfile
+            self._profiler = cProfile.Profile()
+
+        try:
+            exit_code = self._run_switches(switches, argv, jobs)
+        except IOError as exc:
+            if exc.errno != errno.EPIPE:
+                raise
+
+            _discard_stdout()
+            exit_code = 128 + signal.SIGPIPE
+        finally:
+            if profile_path is not None:
+                self._report_profile(profile_path)
+
+        if exit_code is not None:
+            sys.exit(exit_code)
+
+    def _run_switches(self, switches, argv, jobs):
+        """Do what run() was asked to and return the exit code, if any."""
+
+        if 'serve' in switches:
+            self.serve(switches['serve'])
+            return None
+
+        batch_path = switches.get('batch')
+        if batch_path is not None:
+            threads = 'threads' in switches
+            if batch_path == '-':
+                results = self.run_batch(sys.stdin, jobs=jobs, threads=threads)
+            else:
+                try:
+                    batch_file = open(batch_path)
+                except IOError as exc:
+                    return self._report_err(BadBatchFile(batch_path,
+                                                         exc.strerror))
+
+                with batch_file:
+                    results = self.run_batch(batch_file, jobs=jobs,
+                                             threads=threads)
+
+            return max([0] + [code for line_num, code in results])
+
+        return self._run(argv)
+
+    def _report_profile(self, path):
+        """Write out what self._profiler collected and stop profiling.
+
+        path -- file to dump the stats to, or True to list the top
+        functions by cumulative time on stderr.
+
+        """
+
+        profiler, self._profiler = self._profiler, None
+        if path is not True:
+            profiler.dump_stats(path)
+            return
+
+        import pstats
+        stats = pstats.Stats(profiler, stream=sys.stderr)
+        stats.sort_stats('cumulative').print_stats(_PROFILE_TOP_N)
+
+def _discard_stdout():
+    """Send whatever's left to write to stdout to /dev/null.
+
+    For when whatever was reading stdout, like head, has stopped. Python
+    would complain when it flushes stdout on exit otherwise. The caller
+    should exit as if killed by SIGPIPE.
+
+    """
+
+    if not hasattr(sys.stdout, 'fileno'):
+        # Like a _RemoteOutput, so there's no file descriptor to redirect.
+        sys.stdout = open(os.devnull, 'w')
+        return
+
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+    os.close(devnull)
+
+def call_server(socket_path, argv=None):
+    """Run `argv` on the App served at `socket_path` and return its exit code.
+
+    Returns None if no server is listening there, so callers can fall
+    back to running the App themselves. A launcher script can avoid
+    importing the App at all unless there's no server:
+
+    >>> exit_code = cmdline.call_server('/tmp/myapp.sock')
+    >>> if exit_code is None:
+    ...     import myapp
+    ...     myapp.app.run()
+    >>> sys.exit(exit_code)
+
+    The server sees this process's working directory, environment and
+    stdin, and its output goes to this process's stdout and stderr. If
+    stdout is closed early, as by head, returns 141, as if killed by
+    SIGPIPE.
+
+    socket_path -- path of the socket App.serve() is listening on.
+    argv -- optional list of inputs, including the program name.
+            Defaults to sys.argv.
+
+    """
+
+    import socket
+    import struct
+
+    if argv is None:
+        argv = sys.argv
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except socket.error as exc:
+        sock.close()
+        if exc.errno in (errno.ENOENT, errno.ECONNREFUSED):
+            return None
+        raise
+
+    env = dict(os.environ)
+    columns = _get_term_columns(sys.stdout)
+    if 'COLUMNS' not in env and columns is not None:
+        # The server can't see our terminal, so tell it how wide it is.
+        env['COLUMNS'] = str(columns)
+
+    try:
+        _send_frame(sock, 'R', marshal.dumps((list(argv), os.getcwd(), env)))
+
+        outputs = {'O': sys.stdout, 'E': sys.stderr}
+        while True:
+            kind, payload = _recv_frame(sock)
+            if kind in outputs:
+                try:
+                    outputs[kind].write(payload)
+                    outputs[kind].flush()
+                except IOError as exc:
+                    if exc.errno != errno.EPIPE or kind != 'O':
+                        raise
+
+                    # Closing the socket stops the server's side too.
+                    _discard_stdout()
+                    return 128 + signal.SIGPIPE
+            elif kind == 'N':
+                size, = struct.unpack('>I', payload)
+                _send_frame(sock, 'I', os.read(sys.stdin.fileno(), size))
+            elif kind == 'X':
+                exit_code, = struct.unpack('>i', payload)
+                return exit_code
+            else:
+                raise IOError('Lost connection to server at %s.' %
+                              socket_path)
+    finally:
+        sock.close()
+
+def _main():
+    """Run cmdline.py's own command-line interface."""
+
+    tools = App(usage_msg="""Tools for apps written with cmdline.py.""",
+                arg_types={'width': int})
+
+    @tools.command
+    def completion():
+        """Print a bash or zsh script for completing cmdline.py apps.
+
+        Source it from your shell's startup file, as in:
+
+            eval "$(python -m cmdline completion)"
+            cmdline_complete myprog ~/.myprog-completion
+
+        An App keeps its completion index up to date if it's given the
+        path, as in:
+
+            cmdline.App(completion_index=os.path.expanduser(
+                '~/.myprog-completion'))
+
+        """
+
+        sys.stdout.write(_COMPLETION_SCRIPT)
+
+    @tools.command
+    def compile(app_path, out_path, prog=None, width=70):
+        """Write a module that runs an App's commands with less overhead.
+
+        See App.compile() for what the module does, and what it doesn't.
+
+        app_path -- import path of the App, as 'module:name'. The module
+            must be importable from the current directory or PYTHONPATH.
+        out_path -- path to write the module to.
+        prog -- program name to show in help and errors. Defaults to
+            the name of the App's module, plus '.py'.
+        width -- max width of a line of help.
+
+        """
+
+        if '' not in sys.path:
+            sys.path.insert(0, '')
+
+        app = _import_object(app_path)
+        module = app_path.partition(':')[0]
+        if prog is None:
+            prog = module.split('.')[-1] + '.py'
+
+        try:
+            app.compile(out_path, prog, width, module)
+        except ValueError as exc:
+            print >> sys.stderr, 'ERROR: %s' % exc
+            return 1
+
+    tools.run()
+
+if __name__ == '__main__':
+    _main()